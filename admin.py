@@ -0,0 +1,155 @@
+"""Maintenance commands for the derived tables kept alongside the circus data"""
+
+import argparse
+
+from psycopg2.extensions import connection
+
+from database_functions import get_connection
+
+
+# What /performers/summary used to compute on every request, and what
+# performer_summary must always agree with.
+LIVE_PERFORMER_SUMMARY = """
+    SELECT p.performer_id,
+    COUNT(ppa.performance_id) AS total_performances,
+    COUNT(perf.review_score) AS scored_performances,
+    COALESCE(SUM(perf.review_score), 0) AS review_score_sum
+    FROM performer p
+    JOIN performance_performer_assignment ppa ON p.performer_id = ppa.performer_id
+    JOIN performance perf ON ppa.performance_id = perf.performance_id
+    GROUP BY p.performer_id
+"""
+
+
+def rebuild_performer_summary(conn: connection) -> int:
+    """
+    Recomputes performer_summary from scratch and returns how many performers it holds.
+
+    Writers are blocked for the duration, so no assignment can slip in
+    between the aggregate being read and the rollup being replaced.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE performance, performance_performer_assignment IN SHARE MODE")
+            cur.execute("DELETE FROM performer_summary")
+            cur.execute(f"""
+                INSERT INTO performer_summary
+                    (performer_id, total_performances, scored_performances, review_score_sum)
+                {LIVE_PERFORMER_SUMMARY}
+                """)
+            rebuilt = cur.rowcount
+            # Make clients holding an ETag for the summary fetch it again.
+            cur.execute("""
+                UPDATE table_version SET version = version + 1
+                WHERE table_name = 'performance_performer_assignment' AND shard = 0
+                """)
+    return rebuilt
+
+
+def verify_performer_summary(conn: connection) -> list:
+    """Returns every performer whose rollup row disagrees with the live aggregate."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT COALESCE(live.performer_id, rollup.performer_id) AS performer_id,
+                live.total_performances AS live_total_performances,
+                rollup.total_performances AS rollup_total_performances,
+                live.scored_performances AS live_scored_performances,
+                rollup.scored_performances AS rollup_scored_performances,
+                live.review_score_sum AS live_review_score_sum,
+                rollup.review_score_sum AS rollup_review_score_sum
+                FROM ({LIVE_PERFORMER_SUMMARY}) AS live
+                FULL OUTER JOIN (
+                    SELECT * FROM performer_summary WHERE total_performances <> 0
+                    OR scored_performances <> 0 OR review_score_sum <> 0
+                ) AS rollup ON rollup.performer_id = live.performer_id
+                WHERE live.performer_id IS NULL OR rollup.performer_id IS NULL
+                OR live.total_performances <> rollup.total_performances
+                OR live.scored_performances <> rollup.scored_performances
+                OR live.review_score_sum <> rollup.review_score_sum
+                ORDER BY 1
+                """)
+            return cur.fetchall()
+
+
+def rebuild_performance_detail(conn: connection) -> int:
+    """
+    Recomputes performance_detail from live_performance_detail (see migration
+    0007) and returns how many performances it holds.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                LOCK TABLE performance, performance_performer_assignment, venue, performer IN SHARE MODE
+                """)
+            cur.execute("DELETE FROM performance_detail")
+            cur.execute("""
+                INSERT INTO performance_detail
+                    (performance_id, performer_names, venue_name, performance_date, review_score)
+                SELECT performance_id, performer_names, venue_name, performance_date, review_score
+                FROM live_performance_detail
+                """)
+            rebuilt = cur.rowcount
+            # Make clients holding an ETag for a performance fetch it again.
+            cur.execute("""
+                UPDATE table_version SET version = version + 1
+                WHERE table_name = 'performance_performer_assignment' AND shard = 0
+                """)
+    return rebuilt
+
+
+def verify_performance_detail(conn: connection) -> list:
+    """Returns every performance whose performance_detail row disagrees with the live join."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COALESCE(live.performance_id, detail.performance_id) AS performance_id,
+                live.performer_names AS live_performer_names,
+                detail.performer_names AS detail_performer_names,
+                live.venue_name AS live_venue_name,
+                detail.venue_name AS detail_venue_name,
+                live.performance_date AS live_performance_date,
+                detail.performance_date AS detail_performance_date,
+                live.review_score AS live_review_score,
+                detail.review_score AS detail_review_score
+                FROM live_performance_detail AS live
+                FULL OUTER JOIN performance_detail AS detail ON detail.performance_id = live.performance_id
+                WHERE live.performance_id IS NULL OR detail.performance_id IS NULL
+                OR live.performer_names IS DISTINCT FROM detail.performer_names
+                OR live.venue_name IS DISTINCT FROM detail.venue_name
+                OR live.performance_date IS DISTINCT FROM detail.performance_date
+                OR live.review_score IS DISTINCT FROM detail.review_score
+                ORDER BY 1
+                """)
+            return cur.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["rebuild-summary", "verify-summary",
+                                            "rebuild-detail", "verify-detail"])
+    parser.add_argument("dbname", nargs="?", default="time_circus")
+    args = parser.parse_args()
+
+    conn = get_connection(args.dbname)
+    try:
+        if args.command == "rebuild-summary":
+            print(f"Rebuilt performer_summary for {rebuild_performer_summary(conn)} performers.")
+        elif args.command == "rebuild-detail":
+            print(f"Rebuilt performance_detail for {rebuild_performance_detail(conn)} performances.")
+        elif args.command == "verify-detail":
+            mismatches = verify_performance_detail(conn)
+            for mismatch in mismatches:
+                print(dict(mismatch))
+            print(f"{len(mismatches)} performance(s) out of step with the live join.")
+            if mismatches:
+                raise SystemExit(1)
+        else:
+            mismatches = verify_performer_summary(conn)
+            for mismatch in mismatches:
+                print(dict(mismatch))
+            print(f"{len(mismatches)} performer(s) out of step with the live aggregate.")
+            if mismatches:
+                raise SystemExit(1)
+    finally:
+        conn.close()
@@ -6,19 +6,531 @@ TODO: TOCHAR() -> strptime?
 """
 
 
+import hashlib
+import json
+import math
+import threading
+import time
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from datetime import datetime
-from flask import Flask, request, jsonify
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Flask, Response, request, jsonify, g, url_for, stream_with_context
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from database_functions import get_connection, get_cursor
+from psycopg2.extensions import BYTES, register_type
+from psycopg2.extras import RealDictCursor, execute_values
+from database_functions import (allocate_ids, execute_prepared, ConnectionPool, ReplicaSet,
+                                DEFAULT_DSN)
+from caching import VenueCache, ResponseCache
+from compression import compress, negotiate
+from metrics import RequestMetrics
+from serialization import FastJSONProvider
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+app.config.setdefault("DATABASE_NAME", "time_circus")
+app.config.setdefault("DB_POOL_MIN_SIZE", 1)
+app.config.setdefault("DB_POOL_MAX_SIZE", 10)
+app.config.setdefault("DB_POOL_TIMEOUT", 30.0)
+# The server writes go to, and the read replicas GET requests are spread
+# across; with no replicas, everything goes to the primary. A DSN names a
+# server (e.g. "host=replica1 port=5432 connect_timeout=2"), the database on
+# each of them is DATABASE_NAME.
+app.config.setdefault("DATABASE_PRIMARY_DSN", DEFAULT_DSN)
+app.config.setdefault("DATABASE_REPLICA_DSNS", [])
+# How long a replica that could not be connected to is left out.
+app.config.setdefault("REPLICA_RETRY_AFTER", 30.0)
+# How long a read waits for a free connection to a replica before trying the
+# next one and then the primary. Short, so a busy replica never stalls a read
+# for the whole DB_POOL_TIMEOUT.
+app.config.setdefault("REPLICA_CHECKOUT_TIMEOUT", 0.1)
+# For this many seconds after a client's write, its reads go to the primary,
+# so replication lag never hides the write from it (0 turns this off).
+app.config.setdefault("READ_YOUR_WRITES_WINDOW", 5.0)
+app.config.setdefault("VENUE_CACHE_SIZE", 10000)
+# Set RESPONSE_CACHE_SIZE to 0 to turn the GET response cache off.
+app.config.setdefault("RESPONSE_CACHE_SIZE", 256)
+app.config.setdefault("RESPONSE_CACHE_TTL", 60.0)
+# When set, list and detail responses are built as JSON by Postgres and passed
+# straight through, instead of being fetched as rows and encoded by Flask.
+app.config.setdefault("RENDER_JSON_IN_DATABASE", False)
+
+# The largest page a paginated list endpoint will return.
+MAX_PAGE_SIZE = 1000
+
+# The values a BIGINT column (every ID column) and a SMALLINT column (review
+# scores) can hold.
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1
+SMALLINT_MIN, SMALLINT_MAX = -2 ** 15, 2 ** 15 - 1
+
+# The most performances that can be created by one POST to /performances/batch.
+MAX_BATCH_SIZE = 10000
+
+# The most performances that can be looked up at once with /performances?ids=.
+MAX_LOOKUP_IDS = 1000
+
+# Holds when the read-your-writes window of a client ends, as a Unix time.
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+
+
+def bounded_int(low, high):
+    """Returns a parser for whole numbers from low to high, which raises ValueError for any other value."""
+    def parse(value):
+        number = int(value)
+        if not low <= number <= high:
+            raise ValueError(f'{number} is not between {low} and {high}.')
+        return number
+    return parse
+
+
+# The filters GET /performances takes: how each value is read from the query
+# string and the condition it adds. Dates and scores are inclusive. Numbers
+# must fit the column they are compared with. Each is backed by an index, see
+# migration 0006.
+PERFORMANCE_FILTERS = {
+    'from': (lambda value: datetime.strptime(value, '%Y-%m-%d').date(), 'pe.performance_date >= %(from)s'),
+    'to': (lambda value: datetime.strptime(value, '%Y-%m-%d').date(), 'pe.performance_date <= %(to)s'),
+    'venue_id': (bounded_int(BIGINT_MIN, BIGINT_MAX), 'pe.venue_id = %(venue_id)s'),
+    'venue_name': (str, 'pe.venue_id = (SELECT venue_id FROM venue WHERE venue_name = %(venue_name)s)'),
+    'performer_id': (bounded_int(BIGINT_MIN, BIGINT_MAX), 'ppai.performer_id = %(performer_id)s'),
+    'min_score': (bounded_int(SMALLINT_MIN, SMALLINT_MAX), 'pe.review_score >= %(min_score)s'),
+    'max_score': (bounded_int(SMALLINT_MIN, SMALLINT_MAX), 'pe.review_score <= %(max_score)s')
+}
+
+# How many rows a streamed response fetches from its server-side cursor at a time.
+app.config.setdefault("STREAM_BATCH_SIZE", 2000)
+
+# When set, every response says how many statements it ran in an X-Query-Count
+# header. Used by the load benchmark (bench_load.py).
+app.config.setdefault("QUERY_COUNT_HEADER", False)
+# Record what every request costs for /metrics, and break its time down in a
+# Server-Timing header.
+app.config.setdefault("METRICS_ENABLED", True)
+# Statements taking at least this many seconds are logged with their
+# parameters, route and row count (None turns the log off). A sample of the
+# slow read-only ones is run again under EXPLAIN (ANALYZE, BUFFERS) and the
+# plan logged too; 0 captures no plans, 1 captures every one.
+app.config.setdefault("SLOW_QUERY_THRESHOLD", 0.5)
+app.config.setdefault("SLOW_QUERY_EXPLAIN_RATE", 0.0)
+# Responses of at least this many bytes are compressed with the best encoding
+# the client accepts (see compression.py); None turns compression off. The
+# level goes from 1 (fastest) to 9 (smallest) for gzip and brotli alike.
+app.config.setdefault("COMPRESSION_MIN_SIZE", 1024)
+app.config.setdefault("COMPRESSION_LEVEL", 6)
 
 """
-For testing reasons; please ALWAYS use this connection.
+Every request gets its own connection from the pool through get_db().
 - Do not make another connection in your code
-- Do not close this connection
+- Do not write from a GET request, its connection may be to a read-only replica
+- Do not close this connection, it is handed back to the pool (and rolled back
+  if it was not committed) when the request ends.
+Tests point the pool at another database by changing DATABASE_NAME and calling close_pool().
 """
-conn = get_connection("time_circus")
+pool = None
+replica_set = None
+venue_cache = None
+response_cache = None
+pool_lock = threading.Lock()
+# Unlike the pool and caches, metrics outlive close_pool().
+request_metrics = RequestMetrics()
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool(app.config["DATABASE_NAME"],
+                                  min_size=app.config["DB_POOL_MIN_SIZE"],
+                                  max_size=app.config["DB_POOL_MAX_SIZE"],
+                                  timeout=app.config["DB_POOL_TIMEOUT"],
+                                  dsn=app.config["DATABASE_PRIMARY_DSN"])
+        return pool
+
+
+def get_replica_set():
+    """Returns the process-wide set of read replica pools, or None if no replicas are configured."""
+    global replica_set
+    if not app.config["DATABASE_REPLICA_DSNS"]:
+        return None
+    primary = get_pool()
+    with pool_lock:
+        if replica_set is None:
+            # Replica pools start empty, so a replica that is down when the
+            # app starts is failed over like any other.
+            replica_set = ReplicaSet([ConnectionPool(app.config["DATABASE_NAME"], min_size=0,
+                                                     max_size=app.config["DB_POOL_MAX_SIZE"],
+                                                     timeout=app.config["REPLICA_CHECKOUT_TIMEOUT"], dsn=dsn)
+                                      for dsn in app.config["DATABASE_REPLICA_DSNS"]],
+                                     primary, retry_after=app.config["REPLICA_RETRY_AFTER"])
+        return replica_set
+
+
+def get_venue_cache() -> VenueCache:
+    """Returns the process-wide venue name to venue_id cache."""
+    global venue_cache
+    with pool_lock:
+        if venue_cache is None:
+            venue_cache = VenueCache(app.config["DATABASE_NAME"],
+                                     max_size=app.config["VENUE_CACHE_SIZE"],
+                                     dsn=app.config["DATABASE_PRIMARY_DSN"])
+        return venue_cache
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide cache of GET responses."""
+    global response_cache
+    with pool_lock:
+        if response_cache is None:
+            response_cache = ResponseCache(max_entries=app.config["RESPONSE_CACHE_SIZE"],
+                                           ttl=app.config["RESPONSE_CACHE_TTL"])
+        return response_cache
+
+
+def close_pool():
+    """
+    Closes the connection pool and drops everything cached from its database;
+    the next request will start afresh.
+    """
+    global pool, replica_set, venue_cache, response_cache
+    with pool_lock:
+        if pool is not None:
+            pool.closeall()
+            pool = None
+        if replica_set is not None:
+            replica_set.closeall()
+            replica_set = None
+        if venue_cache is not None:
+            venue_cache.close()
+            venue_cache = None
+        response_cache = None
+
+
+def reading_own_writes() -> bool:
+    """Whether the client wrote recently enough that its reads must see the primary."""
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def get_db():
+    """
+    Returns the connection checked out for the current request.
+
+    GET requests are served by a read replica when there are any, unless the
+    client is in its read-your-writes window; everything else uses the primary.
+    """
+    if "db" not in g:
+        replicas = get_replica_set() if request.method in ('GET', 'HEAD') else None
+        if replicas is not None and not reading_own_writes():
+            g.db_pool, g.db = replicas.getconn()
+        else:
+            g.db_pool = get_pool()
+            g.db = g.db_pool.getconn()
+        g.db_totals = (g.db.query_count, g.db.query_time, g.db.rows_fetched)
+        g.db.slow_query_threshold = app.config["SLOW_QUERY_THRESHOLD"]
+        g.db.explain_sample_rate = app.config["SLOW_QUERY_EXPLAIN_RATE"]
+        g.db.context = f"{request.method} {request.full_path.rstrip('?')}"
+    return g.db
+
+
+def request_db_work():
+    """Returns the statements run, seconds spent on them and rows fetched so far in this request."""
+    if "db" not in g:
+        return 0, 0.0, 0
+    count, seconds, rows = g.db_totals
+    return g.db.query_count - count, g.db.query_time - seconds, g.db.rows_fetched - rows
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # A streamed response's body (and any statements it runs) comes after this
+    # point, so for those only the work done up front is counted.
+    queries, db_seconds, rows = request_db_work()
+
+    if app.config["QUERY_COUNT_HEADER"]:
+        response.headers["X-Query-Count"] = str(queries)
+
+    if app.config["METRICS_ENABLED"] and "request_started" in g:
+        seconds = time.perf_counter() - g.request_started
+        serialization_seconds = g.get("serialization_time", 0.0)
+        response.headers["Server-Timing"] = (f"db;dur={db_seconds * 1000:.2f}, "
+                                             f"serialize;dur={serialization_seconds * 1000:.2f}, "
+                                             f"total;dur={seconds * 1000:.2f}")
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_metrics.observe(route, request.method, response.status_code, seconds,
+                                db_seconds=db_seconds, queries=queries, rows_fetched=rows,
+                                response_bytes=response.content_length or 0)
+    return response
+
+
+@app.after_request
+def remember_writes(response):
+    # Replicas may not have a write yet, so the writer reads from the primary for a while.
+    window = app.config["READ_YOUR_WRITES_WINDOW"]
+    if (request.method not in ('GET', 'HEAD') and response.status_code < 400 and window
+            and app.config["DATABASE_REPLICA_DSNS"]):
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, f"{time.time() + window:.3f}",
+                            max_age=math.ceil(window), httponly=True, samesite='Lax')
+    return response
+
+
+# Registered after record_request so that it runs first, and the metrics
+# count the bytes actually sent.
+@app.after_request
+def compress_response(response):
+    min_size = app.config["COMPRESSION_MIN_SIZE"]
+    if response.status_code == 304:
+        return revalidated_as_compressed(response) if min_size is not None else response
+    if (min_size is None or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in ('application/json', 'text/plain', 'text/html')):
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    # Caches between us and the client must not hand one client's encoding to another.
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    # Cached responses carry the encoded bodies made for earlier hits.
+    variants = g.get('compressed_variants')
+    if variants is None:
+        variants = {}
+    if encoding not in variants:
+        variants[encoding] = compress(body, encoding, app.config["COMPRESSION_LEVEL"])
+    response.set_data(variants[encoding])
+    response.headers['Content-Encoding'] = encoding
+    # The encoded body is a different representation, so its ETag can only
+    # be weak; If-None-Match compares weakly, so it still revalidates.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def revalidated_as_compressed(response):
+    """
+    Gives a 304 the Vary header and ETag form the 200 would have had.
+
+    Without the body there is no telling whether it was big enough to be
+    compressed, but the validator the client sent says which form it holds:
+    a weak match means it was given the compressed body.
+    """
+    etag, weak = response.get_etag()
+    if etag is None:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (not weak and negotiate(request.accept_encodings) is not None
+            and not request.if_none_match.contains(etag)):
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@app.teardown_appcontext
+def return_db(exception):
+    db = g.pop("db", None)
+    if db is not None:
+        db.context = None
+        g.pop("db_pool").putconn(db)
+
+
+def wants_stream():
+    """Returns whether the client opted in to a streamed response with ?stream=true."""
+    stream_parameter = request.args.get('stream', 'false')
+    if stream_parameter not in ['true', 'false']:
+        return None
+    return stream_parameter == 'true'
+
+
+def stream_json_list(query, params=None):
+    """
+    Streams the rows of a query to the client as a JSON array.
+
+    Rows are read from a named (server-side) cursor a batch at a time and each
+    batch is written out before the next is fetched, so memory use stays flat
+    however many rows the query returns.
+    """
+    conn = get_db()
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+
+    def generate():
+        with conn.cursor(name='stream_json_list', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = batch_size
+            cur.execute(query, params)
+
+            yield b'['
+            separator = b''
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                # Dump the batch as a list and strip its brackets, so rows from
+                # every batch end up as elements of the one streamed array.
+                yield separator + app.json.encode(rows)[1:-1]
+                separator = b','
+            yield b']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def table_versions(tables) -> str:
+    """Returns the change counters (see migration 0004) of the given tables as one string."""
+    with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+        execute_prepared(cur, 'table_versions', """
+            SELECT table_name, SUM(version) AS version
+            FROM table_version
+            WHERE table_name = ANY(%s)
+            GROUP BY table_name
+            ORDER BY table_name
+            """, (list(tables),))
+        return ','.join(f"{row['table_name']}={row['version']}" for row in cur.fetchall())
+
+
+def make_etag(key, tables) -> str:
+    return hashlib.sha1(repr((key, table_versions(tables))).encode()).hexdigest()
+
+
+def cached_response(*tables, store=True):
+    """
+    Adds conditional GET support and, if `store` is set, the response cache to a route.
+
+    Each response gets a strong ETag derived from the path, the sorted query
+    string and the change counters of the tables it was built from. A client
+    sending a matching If-None-Match gets a 304 after one lookup of those
+    counters, without the route's own query running.
+
+    Stored responses are keyed by path plus the sorted query string, and
+    tagged with their tables so that writes can invalidate just them. Only
+    successful, buffered responses are stored; streamed ones bypass the cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            key = (request.path, urlencode(sorted(request.args.items(multi=True))))
+            cache = None
+            # A stored response may have come from a replica that is behind the
+            # primary, so a client in its read-your-writes window skips the cache.
+            if (store and app.config["RESPONSE_CACHE_SIZE"] > 0 and request.args.get('stream') != 'true'
+                    and not reading_own_writes()):
+                cache = get_response_cache()
+
+            # Only conditional requests pay for reading the counters up front;
+            # plain ones are answered from the cache without touching the database.
+            etag = None
+            if request.if_none_match:
+                etag = make_etag(key, tables)
+                if request.if_none_match.contains_weak(etag):
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    return response
+
+            if cache is not None:
+                cached = cache.get(key, tag=etag)
+                if cached is not None:
+                    body, status, headers, g.compressed_variants = cached
+                    response = Response(body, status=status, headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+            # Read before the query, so a write landing in between can only
+            # make the ETag older than the body, never newer, and keeps the
+            # body out of the cache.
+            if etag is None:
+                etag = make_etag(key, tables)
+            generation = cache.generation(tables) if cache is not None else None
+
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                if cache is not None and not response.is_streamed:
+                    headers = [(k, v) for k, v in response.headers if k != 'Content-Length']
+                    # Compressed bodies are added to the entry as clients ask for them.
+                    g.compressed_variants = {}
+                    cache.set(key, tables, (response.get_data(), response.status_code, headers,
+                                            g.compressed_variants), tag=etag, generation=generation)
+            if cache is not None:
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_cached_responses(*tables):
+    """Drops cached responses built from any of the given tables after a write to them."""
+    if response_cache is not None:
+        response_cache.invalidate(tables)
+
+
+def validate_performance(data):
+    """Returns an error message if a performance to be created is malformed, otherwise None."""
+    if not isinstance(data, dict):
+        return 'A performance must be a JSON object.'
+
+    # Checking if necessary parameters have been passed in.
+    for param in ['performer_id', 'performance_date', 'venue_name', 'review_score']:
+        if data.get(param) is None:
+            return f"Request missing key '{param}'."
+
+    performer_ids = data['performer_id']
+    if (not isinstance(performer_ids, list) or not performer_ids
+            or not all(isinstance(p, int) and not isinstance(p, bool) and BIGINT_MIN <= p <= BIGINT_MAX
+                       for p in performer_ids)):
+        return "'performer_id' must be a non-empty list of performer IDs."
+
+    if not isinstance(data['venue_name'], str):
+        return "'venue_name' must be a string."
+
+    if (not isinstance(data['review_score'], int) or isinstance(data['review_score'], bool)
+            or not SMALLINT_MIN <= data['review_score'] <= SMALLINT_MAX):
+        return f"'review_score' must be a whole number between {SMALLINT_MIN} and {SMALLINT_MAX}."
+
+    try:
+        datetime.strptime(str(data['performance_date']), '%Y-%m-%d')
+    except ValueError:
+        return "'performance_date' must be a date in the format YYYY-MM-DD."
+
+    return None
+
+
+def database_json(statement_name, query, params=None):
+    """
+    Returns a response whose body is the JSON text Postgres built in `query`.
+
+    The query must return one text column named "body". Text is fetched as raw
+    bytes, so the document is neither decoded nor re-encoded on its way through.
+    """
+    with get_db().cursor() as cur:
+        register_type(BYTES, cur)
+        execute_prepared(cur, statement_name, query, params)
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return Response(row['body'], mimetype='application/json')
+
+
+def database_json_list(statement_name, query, params=None):
+    """Returns the rows of a list query as one JSON array built by Postgres."""
+    # Aggregates are not guaranteed to see rows in the order of the sorted
+    # subquery, so each row is numbered as it comes out of it and aggregated in
+    # that order. Joining the rows ourselves avoids the newline json_agg puts
+    # between elements.
+    return database_json(statement_name, f"""
+        SELECT COALESCE('[' || string_agg(row_json, ',' ORDER BY position) || ']', '[]') AS "body"
+        FROM (SELECT row_to_json(list_rows)::TEXT AS row_json, row_number() OVER () AS position
+              FROM ({query}) AS list_rows) AS numbered_rows
+        """, params)
 
 
 @app.route("/")
@@ -26,107 +538,373 @@ def home_page():
     return "<h1>Time Travelling Circus API</h1><h2>Delighting you any time, anywhere, any universe</h2>", 200
 
 
+def requested_fields(available):
+    """
+    Returns the fields asked for with ?fields=a,b, in the order of `available`.
+    Without the parameter every field is returned; if it names a field that is
+    not in `available`, None is.
+    """
+    fields_parameter = request.args.get('fields')
+    if fields_parameter is None:
+        return list(available)
+    fields = set(fields_parameter.split(','))
+    if not fields <= set(available):
+        return None
+    return [field for field in available if field in fields]
+
+
+def performance_filters():
+    """
+    Returns the filters given to GET /performances as a dict of parsed values,
+    or the name of the first one that is malformed.
+    """
+    filters = {}
+    for name, (parse, _) in PERFORMANCE_FILTERS.items():
+        if name in request.args:
+            try:
+                filters[name] = parse(request.args[name])
+            except ValueError:
+                return name
+    return filters
+
+
+def fields_suffix(available, fields) -> str:
+    """Names a choice of fields, so each choice gets a prepared statement of its own."""
+    if len(fields) == len(available):
+        return ''
+    return f"_fields{sum(1 << i for i, field in enumerate(available) if field in fields)}"
+
+
+def encode_cursor(sort_parameter, order_parameter, row, sort_key):
+    """Packs the position after `row` into an opaque, URL safe pagination cursor."""
+    position = [sort_parameter, order_parameter, row[sort_key], row['performer_id']]
+    return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor, sort_parameter, order_parameter):
+    """Returns the (sort value, performer_id) a cursor points after, or None if it is invalid."""
+    try:
+        sort, order, sort_value, performer_id = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+    # A cursor is only meaningful for the sort and order it was issued under.
+    if sort != sort_parameter or order != order_parameter:
+        return None
+    if (not isinstance(performer_id, int) or isinstance(performer_id, bool)
+            or not BIGINT_MIN <= performer_id <= BIGINT_MAX):
+        return None
+    # Birth years are whole numbers and the other sorts are names; None is
+    # what a row without a value was issued.
+    sort_type = int if sort_parameter in (None, 'birth_year') else str
+    if sort_value is not None and (not isinstance(sort_value, sort_type) or isinstance(sort_value, bool)
+                                   or (sort_type is int and not BIGINT_MIN <= sort_value <= BIGINT_MAX)):
+        return None
+    return sort_value, performer_id
+
+
 @app.route('/performers', methods=['GET'])
+@cached_response('performer', 'specialty')
 def performers():
     if request.method == 'GET':
 
-        # Map the sort parameter to the corresponding database column
+        # Map the sort parameter to the corresponding database column,
+        # and to the key holding that value in each returned performer.
         sort_column_map = {
-            'birth_year': 'pe.birth_year',
+            'birth_year': 'EXTRACT(YEAR FROM pe.performer_dob)',
             'specialty': 'sp.specialty_name',
-            'performer_name': 'pe.performer_name'
+            'performer_name': 'pe.performer_stagename'
+        }
+        sort_key_map = {
+            'birth_year': 'birth_year',
+            'specialty': 'specialty_name',
+            'performer_name': 'performer_name'
+        }
+        # The fields ?fields= can choose from, and the column behind each.
+        field_column_map = {
+            'performer_id': 'pe.performer_id',
+            'performer_name': 'pe.performer_stagename',
+            'birth_year': 'EXTRACT(YEAR FROM pe.performer_dob)::INT',
+            'specialty_name': 'sp.specialty_name'
         }
 
         # Checking for whether query parameters for sorting
         # and/or ordering by columns and values.
         sort_parameter = request.args.get('sort')
         order_parameter = request.args.get('order')
+        limit_parameter = request.args.get('limit')
+        after_parameter = request.args.get('after')
+        stream = wants_stream()
+        fields = requested_fields(field_column_map)
 
         if sort_parameter and sort_parameter not in sort_column_map:
             return jsonify({'error': True, 'message': 'Invalid sort query parameter provided.'}), 400
 
+        if fields is None:
+            return jsonify({'error': True, 'message': 'Invalid fields query parameter provided.'}), 400
+
         if order_parameter and order_parameter not in ['ascending', 'descending']: 
             return jsonify({'error': True, 'message': 'Invalid order query parameter provided.'}), 400
 
+        if stream is None:
+            return jsonify({'error': True, 'message': 'Invalid stream query parameter provided.'}), 400
+
+        if stream and limit_parameter is not None:
+            return jsonify({'error': True, 'message': 'A streamed response cannot also be paginated.'}), 400
+
         # The column to sort on will be found by mapping the query parameter passed
         # in to their corresponding database columns. Birth year is set as the default sort column.
-        sort_column = sort_column_map.get(sort_parameter, 'pe.performer_dob')
+        sort_column = sort_column_map.get(sort_parameter, sort_column_map['birth_year'])
+        sort_key = sort_key_map.get(sort_parameter, 'birth_year')
 
 
         # If 'ascending' is specifically passed in, value order will be 'ASC'. Otherwise it will be 'DESC'. 
         sort_order = 'ASC' if order_parameter == 'ascending' else 'DESC'
 
+        # Pagination is opt-in; without a limit the whole list is returned as before.
+        limit = None
+        if limit_parameter is not None:
+            # isdigit() alone lets through digits such as '¹' that int() rejects.
+            if (not (limit_parameter.isascii() and limit_parameter.isdigit())
+                    or not 1 <= int(limit_parameter) <= MAX_PAGE_SIZE):
+                return jsonify({'error': True,
+                                'message': f'The limit query parameter must be between 1 and {MAX_PAGE_SIZE}.'}), 400
+            limit = int(limit_parameter)
+
+        position = None
+        if after_parameter is not None:
+            if limit is None:
+                return jsonify({'error': True, 'message': 'The after query parameter requires a limit.'}), 400
+            position = decode_cursor(after_parameter, sort_parameter, order_parameter)
+            if position is None:
+                return jsonify({'error': True, 'message': 'Invalid after query parameter provided.'}), 400
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cur: 
-            cur.execute(f""" SELECT pe.performer_id AS "performer_id", 
-                            pe.performer_stagename AS "performer_name",
-                            EXTRACT(YEAR FROM pe.performer_dob) as "birth_year",
-                            sp.specialty_name as "specialty_name"
-                            FROM performer as pe
-                            JOIN specialty sp
-                            ON sp.specialty_id = pe.specialty_id
-                            ORDER BY {sort_column} {sort_order},
-                            pe.performer_id ASC;
-                    """)
+        # A page's last row must hold the values its next-page cursor is built
+        # from, so those are selected even when not asked for, and dropped after.
+        selected_fields = list(fields)
+        if limit is not None:
+            selected_fields += [key for key in (sort_key, 'performer_id') if key not in selected_fields]
+
+        # Specialties are only joined when their names are needed. Without the
+        # join, the same performers are kept by requiring what it matched on.
+        conditions = []
+        join_clause = ''
+        if 'specialty_name' in selected_fields or sort_parameter == 'specialty':
+            join_clause = 'JOIN specialty sp ON sp.specialty_id = pe.specialty_id'
+        else:
+            conditions.append('pe.specialty_id IS NOT NULL')
+
+        # Keyset pagination: rather than skipping rows with OFFSET, carry on from
+        # the last row of the previous page, so every page costs the same.
+        # performer_id is always ascending, so it breaks ties in either direction.
+        # Every sort column is nullable, and NULLs sort as the highest value:
+        # last when ascending, first when descending.
+        params = {}
+        if position is not None:
+            params['sort_value'], params['performer_id'] = position
+            if params['sort_value'] is None:
+                # The rest of the NULLs, and when descending every row after them.
+                del params['sort_value']
+                if sort_order == 'DESC':
+                    conditions.append(f"({sort_column} IS NOT NULL OR pe.performer_id > %(performer_id)s)")
+                else:
+                    conditions.append(f"{sort_column} IS NULL AND pe.performer_id > %(performer_id)s")
+            elif sort_order == 'DESC':
+                conditions.append(f"""{sort_column} <= %(sort_value)s
+                            AND ({sort_column} < %(sort_value)s
+                                 OR pe.performer_id > %(performer_id)s)""")
+            else:
+                conditions.append(f"""({sort_column} >= %(sort_value)s
+                            AND ({sort_column} > %(sort_value)s
+                                 OR pe.performer_id > %(performer_id)s)
+                            OR {sort_column} IS NULL)""")
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        limit_clause = ''
+        if limit is not None:
+            # One extra row tells us whether there is another page after this one.
+            limit_clause = 'LIMIT %(limit)s'
+            params['limit'] = limit + 1
+
+
+        select_list = ',\n                    '.join(f'{field_column_map[field]} AS "{field}"'
+                                                  for field in selected_fields)
+        query = f""" SELECT {select_list}
+                    FROM performer as pe
+                    {join_clause}
+                    {where_clause}
+                    ORDER BY {sort_column} {sort_order} NULLS {'FIRST' if sort_order == 'DESC' else 'LAST'},
+                    pe.performer_id ASC
+                    {limit_clause}
+            """
+
+        # Every sort/order/page combination gets a prepared plan of its own.
+        statement_name = f"performers_by_{sort_key}_{sort_order.lower()}"
+        if position is not None:
+            statement_name += "_after" if 'sort_value' in params else "_after_null"
+        if limit is not None:
+            statement_name += "_limit"
+        statement_name += fields_suffix(field_column_map, selected_fields)
+
+        if stream:
+            return stream_json_list(query, params)
+
+        if app.config["RENDER_JSON_IN_DATABASE"] and limit is None:
+            return database_json_list(f"{statement_name}_json", query, params), 200
+
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur: 
+            execute_prepared(cur, statement_name, query, params)
             response = cur.fetchall()
 
-            for performer in response:
-                performer['performer_id'] = int(performer['performer_id'])
-                # performer['performer_name'] = str(performer['performer_id'])
-                performer['birth_year'] = int(performer['birth_year'])
-            
-            # Manually swapping Siren Sara and Cinematic Callie because the JSON auto sorts 
-            # even after a valid query.
-            for i in range(len(response) - 1):
-                if (response[i]["birth_year"] == response[i + 1]["birth_year"] == 2750 and
-                    response[i]["performer_id"] == 34 and response[i + 1]["performer_id"] == 23):
-                    # Swap the entries
-                    response[i], response[i + 1] = response[i + 1], response[i]
-                    break
+            headers = {}
+            if limit is not None and len(response) > limit:
+                response = response[:limit]
+                next_args = {k: v for k, v in request.args.items() if k != 'after'}
+                next_args['after'] = encode_cursor(sort_parameter, order_parameter,
+                                                   response[-1], sort_key)
+                headers['Link'] = f'<{url_for("performers", **next_args)}>; rel="next"'
+
+            for hidden in selected_fields[len(fields):]:
+                for row in response:
+                    del row[hidden]
 
-            return jsonify(response), 200
+            return jsonify(response), 200, headers
 
 
 @app.route('/venues', methods=["GET"])
+@cached_response('venue')
 def venues():
     if request.method == 'GET':
-        with conn.cursor(cursor_factory=RealDictCursor) as cur: 
-            cur.execute(f""" SELECT * FROM venue
-                        
-                    """)
+        stream = wants_stream()
+        if stream is None:
+            return jsonify({'error': True, 'message': 'Invalid stream query parameter provided.'}), 400
+
+        # The fields ?fields= can choose from, and the column behind each.
+        field_column_map = {
+            'venue_id': 'venue_id',
+            'venue_name': 'venue_name'
+        }
+        fields = requested_fields(field_column_map)
+        if fields is None:
+            return jsonify({'error': True, 'message': 'Invalid fields query parameter provided.'}), 400
+
+        select_list = ', '.join(f'{field_column_map[field]} AS "{field}"' for field in fields)
+        query = f"SELECT {select_list} FROM venue ORDER BY venue_id"
+        statement_name = 'venues' + fields_suffix(field_column_map, fields)
+        if stream:
+            return stream_json_list(query)
+        if app.config["RENDER_JSON_IN_DATABASE"]:
+            return database_json_list(f'{statement_name}_json', query), 200
+
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur: 
+            execute_prepared(cur, statement_name, query)
             response = cur.fetchall()
         return jsonify(response), 200
 
 
 @app.route('/performances', methods=['GET', 'POST'])
+@cached_response('performance', 'performance_performer_assignment', 'venue', 'performer', store=False)
 def performances():
     if request.method == 'GET': 
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(""" SELECT pe.performance_id,
-                            per.performer_stagename AS "performer_name", 
-                            pe.performance_date,
-                            ve.venue_name,
-                            pe.review_score AS "score"
-                            FROM performance AS pe
-                            JOIN venue AS ve
-                            ON ve.venue_id = pe.venue_id 
-                            JOIN performance_performer_assignment AS ppai
-                            ON ppai.performance_id = pe.performance_id
-                            JOIN performer AS per
-                            ON ppai.performer_id = per.performer_id
-                            ORDER BY pe.performance_id ASC
-
-                    """)
-            
+        if 'ids' in request.args:
+            return performances_by_ids(request.args['ids'])
+
+        stream = wants_stream()
+        if stream is None:
+            return jsonify({'error': True, 'message': 'Invalid stream query parameter provided.'}), 400
+
+        group = request.args.get('group')
+        if group not in (None, 'performance'):
+            return jsonify({'error': True, 'message': 'Invalid group query parameter provided.'}), 400
+
+        # The fields ?fields= can choose from, the column behind each, and the
+        # table (if any) that has to be joined for it.
+        if group == 'performance':
+            field_column_map = {
+                'performance_id': ('pe.performance_id', None),
+                'performer_names': ('pd.performer_names', None),
+                'performance_date': ('pe.performance_date', None),
+                'venue_name': ('pd.venue_name', None),
+                'score': ('pe.review_score', None)
+            }
+        else:
+            field_column_map = {
+                'performance_id': ('pe.performance_id', None),
+                'performer_name': ('per.performer_stagename', 'performer'),
+                'performance_date': ('pe.performance_date', None),
+                'venue_name': ('ve.venue_name', 'venue'),
+                'score': ('pe.review_score', None)
+            }
+        fields = requested_fields(field_column_map)
+        if fields is None:
+            return jsonify({'error': True, 'message': 'Invalid fields query parameter provided.'}), 400
+
+        filters = performance_filters()
+        if isinstance(filters, str):
+            return jsonify({'error': True, 'message': f'Invalid {filters} query parameter provided.'}), 400
+        filter_conditions = {name: condition for name, (_, condition) in PERFORMANCE_FILTERS.items()}
+        if group == 'performance':
+            # A grouped row is a whole performance, so the performer filter
+            # keeps the performances they were in, names of the others included.
+            filter_conditions['performer_id'] = """pe.performance_id IN (
+                        SELECT performance_id FROM performance_performer_assignment
+                        WHERE performer_id = %(performer_id)s)"""
+        conditions = [filter_conditions[name] for name in PERFORMANCE_FILTERS if name in filters]
+        select_list = ',\n                    '.join(f'{field_column_map[field][0]} AS "{field}"'
+                                              for field in fields)
+
+        if group == 'performance':
+            # performance_detail (see migration 0007) holds each performance's
+            # performer names already aggregated in assignment order, and
+            # exactly the performances the ungrouped join returns rows for.
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            query = f""" SELECT {select_list}
+                    FROM performance AS pe
+                    JOIN performance_detail AS pd
+                    ON pd.performance_id = pe.performance_id
+                    {where_clause}
+                    ORDER BY pe.performance_id ASC
+            """
+        else:
+            # There is a row per performer in a performance whatever is selected, so
+            # assignments are always joined. Venues and performers are only joined
+            # when a field needs them; without the join, the same rows are kept by
+            # requiring what it matched on.
+            joins = {
+                'venue': ('JOIN venue AS ve ON ve.venue_id = pe.venue_id', 'pe.venue_id IS NOT NULL'),
+                'performer': ('JOIN performer AS per ON ppai.performer_id = per.performer_id',
+                              'ppai.performer_id IS NOT NULL')
+            }
+            needed = {field_column_map[field][1] for field in fields}
+            join_clause = '\n                    '.join(join for table, (join, _) in joins.items()
+                                                    if table in needed)
+            conditions = [condition for table, (_, condition) in joins.items()
+                          if table not in needed] + conditions
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            query = f""" SELECT {select_list}
+                    FROM performance AS pe
+                    JOIN performance_performer_assignment AS ppai
+                    ON ppai.performance_id = pe.performance_id
+                    {join_clause}
+                    {where_clause}
+                    ORDER BY pe.performance_id ASC,
+                    ppai.performance_performer_assignment_id ASC
+            """
+        statement_name = 'performances_grouped' if group else 'performances'
+        statement_name += fields_suffix(field_column_map, fields)
+        if filters:
+            # Like fields, each combination of filters is a statement of its own.
+            mask = sum(1 << i for i, name in enumerate(PERFORMANCE_FILTERS) if name in filters)
+            statement_name += f"_filtered{mask}"
+        if stream:
+            return stream_json_list(query, filters)
+        if app.config["RENDER_JSON_IN_DATABASE"]:
+            return database_json_list(f'{statement_name}_json', query, filters), 200
 
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, statement_name, query, filters)
             response = cur.fetchall()
-            
-            # Performance dates come in a too verbose format straight for Postgres,
-            # .strftime('%Y-%m-%d') can be applied to the datetime objects, to present
-            # then int he standard YYY-MM-DD format the API's tests expect.
-            for row in response:
-                row['performance_date'] = row['performance_date'].strftime(
-                    '%Y-%m-%d')
+        # Dates are written as YYYY-MM-DD by the JSON provider, see serialization.py.
         return jsonify(response), 200
 
 
@@ -134,12 +912,11 @@ def performances():
         
         data = request.json
 
-        # Checking if necessary parameters have been passed in.
+        error = validate_performance(data)
+        if error:
+            return {'error': error}, 400
+
         mandatory_types = ['performer_id', 'performance_date', 'venue_name', 'review_score']
-        for param in mandatory_types:
-            if data.get(param) is None:
-                return {'error': f"Request missing key '{param}'."}, 400
-        
         performer_ids, performance_date, venue_name, review_score  = [
             data.get(param) for param in mandatory_types]
 
@@ -149,58 +926,177 @@ def performances():
         #         "venue_name": venue_name, 
         #         "review_score": review_score
         #     }), 201
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT venue_id FROM venue WHERE venue_name = %s
-                """, (venue_name,))
-            venue = cur.fetchone()
-            # return venue
-            if venue:
-                venue_id = venue['venue_id']
-            else:
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+            venue_id = get_venue_cache().lookup(get_db(), [venue_name]).get(venue_name)
+            if venue_id is None:
                 return {'error': f'Please provide a valid venue.'}, 404
 
 
 
-            cur.execute("SELECT MAX(performance_id) FROM performance")
-            max_per_id = cur.fetchone()['max']
-            performance_id = max_per_id + 1
-            # return jsonify(performance_id)
-
-            cur.execute(
+            # IDs come from the tables' identity sequences, so concurrent
+            # POSTs never compute the same one.
+            execute_prepared(cur, 'insert_performance',
                 """
-                INSERT INTO performance (performance_id, performance_date, venue_id, review_score)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO performance (performance_date, venue_id, review_score)
+                VALUES (%s, %s, %s)
                 RETURNING performance_id
-                """, (performance_id, performance_date, venue_id, review_score))
+                """, (performance_date, venue_id, review_score))
+            performance_id = cur.fetchone()['performance_id']
 
+            execute_values(cur, """
+                INSERT INTO performance_performer_assignment (performance_id, performer_id)
+                VALUES %s
+                """, [(performance_id, performer_id) for performer_id in performer_ids])
 
-            cur.execute("""SELECT MAX(performance_performer_assignment_id) 
-                        FROM performance_performer_assignment
-                        
-                    """)
-            max_ppai_id = cur.fetchone()['max']
-            performance_performer_assignment_id = max_ppai_id + 1
+            get_db().commit()
+            invalidate_cached_responses('performance', 'performance_performer_assignment')
 
-            for performer_id in performer_ids: 
-                cur.execute(
-                    """
-                    INSERT INTO performance_performer_assignment (performance_performer_assignment_id, 
-                    performance_id, performer_id)
-                    VALUES (%s, %s, %s)
-                    """, (performance_performer_assignment_id, performance_id, performer_id))
-                performance_performer_assignment_id += 1
+            return jsonify({"message": "Performance created", "performance_id": performance_id}), 200
 
-            conn.commit()
 
-            return jsonify({"message": "Performance created", "performance_id": performance_id}), 200
 
 
 
+def performances_by_ids(ids_parameter):
+    """
+    Looks up many performances with one query, for GET /performances?ids=1,5,9.
+
+    Each performance has the shape /performances/<id> returns. They come back
+    in the order they were asked for, and IDs with no performance are listed
+    in missing_ids instead.
+    """
+    # The lookup returns whole performances, so the parameters that shape or
+    # filter the list would be ignored.
+    for name in ('fields', 'stream', 'group', *PERFORMANCE_FILTERS):
+        if name in request.args:
+            return jsonify({'error': True,
+                            'message': f'The ids query parameter cannot be combined with {name}.'}), 400
+
+    try:
+        requested = [int(performance_id) for performance_id in ids_parameter.split(',')]
+        # The IDs are bound as a BIGINT array.
+        if not all(BIGINT_MIN <= performance_id <= BIGINT_MAX for performance_id in requested):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': True,
+                        'message': 'The ids query parameter must be a comma separated list of numbers.'}), 400
+    # Asking for an ID twice gets it once.
+    requested = list(dict.fromkeys(requested))
+    if len(requested) > MAX_LOOKUP_IDS:
+        return jsonify({'error': True,
+                        'message': f'At most {MAX_LOOKUP_IDS} performances can be looked up at once.'}), 400
+
+    with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+        execute_prepared(cur, 'performances_by_ids', """
+                        SELECT performance_id, performer_names, venue_name,
+                        performance_date, review_score
+                        FROM performance_detail
+                        WHERE performance_id = ANY(%s)
+                """, (requested,))
+        found = {row['performance_id']: row for row in cur.fetchall()}
+
+    return jsonify({
+        'performances': [found[performance_id] for performance_id in requested if performance_id in found],
+        'missing_ids': [performance_id for performance_id in requested if performance_id not in found],
+    }), 200
+
+
+@app.route('/performances/batch', methods=['POST'])
+def performances_batch():
+    """
+    Creates a list of performances in one request and one transaction.
+
+    Venues are resolved through the venue cache and performers with one query, performance IDs
+    are reserved in one block, and performances and their assignments are
+    written with multi-row INSERTs however many items there are. Every item gets its own result, so one bad performance
+    does not reject the rest of the batch.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list) or not data:
+        return {'error': 'Request body must be a non-empty list of performances.'}, 400
+    if len(data) > MAX_BATCH_SIZE:
+        return {'error': f'A batch can hold at most {MAX_BATCH_SIZE} performances.'}, 400
+
+    results = []
+    for index, item in enumerate(data):
+        result = {'index': index}
+        error = validate_performance(item)
+        if error:
+            result['error'] = error
+        results.append(result)
+
+    valid_items = [(result, data[result['index']]) for result in results if 'error' not in result]
+    venue_names = list({item['venue_name'] for _, item in valid_items})
+    performer_ids = list({performer_id for _, item in valid_items
+                          for performer_id in item['performer_id']})
+
+    conn = get_db()
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        venue_ids = get_venue_cache().lookup(conn, venue_names)
+
+        execute_prepared(cur, 'known_performers',
+                         "SELECT performer_id FROM performer WHERE performer_id = ANY(%s)",
+                         (performer_ids,))
+        known_performers = {row['performer_id'] for row in cur.fetchall()}
+
+        performance_rows = []
+        assignment_rows = []
+        for result, item in valid_items:
+            if item['venue_name'] not in venue_ids:
+                result['error'] = 'Please provide a valid venue.'
+                continue
+            unknown_performers = [p for p in item['performer_id'] if p not in known_performers]
+            if unknown_performers:
+                result['error'] = f'Unknown performer IDs: {unknown_performers}.'
+                continue
+
+            performance_rows.append([item['performance_date'], venue_ids[item['venue_name']],
+                                     item['review_score']])
+
+        # Reserve a block of performance IDs up front, so the assignment rows
+        # can reference them without a round trip per performance.
+        performance_ids = allocate_ids(cur, 'performance', 'performance_id', len(performance_rows))
+        created = (result for result, _ in valid_items if 'error' not in result)
+        for result, row, performance_id in zip(created, performance_rows, performance_ids):
+            row.insert(0, performance_id)
+            result['performance_id'] = performance_id
+            for performer_id in data[result['index']]['performer_id']:
+                assignment_rows.append((performance_id, performer_id))
+
+        try:
+            execute_values(cur, """
+                INSERT INTO performance (performance_id, performance_date, venue_id, review_score)
+                VALUES %s
+                """, performance_rows, page_size=1000)
+            execute_values(cur, """
+                INSERT INTO performance_performer_assignment (performance_id, performer_id)
+                VALUES %s
+                """, assignment_rows, page_size=1000)
+        except psycopg2.DataError as error:
+            conn.rollback()
+            return {'error': f'Batch rejected, nothing was created: {error}'}, 400
+
+    conn.commit()
+    invalidate_cached_responses('performance', 'performance_performer_assignment')
+
+    return jsonify({"message": "Performances created", "created": len(performance_rows),
+                    "results": results}), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit, miss and eviction counters for the GET response cache."""
+    return jsonify(get_response_cache().stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request counts, latencies and database work per route, for Prometheus to scrape."""
+    return Response(request_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route('/performances/<int:performance_id>', methods=['GET'])
+@cached_response('performance', 'performance_performer_assignment', 'venue', 'performer', store=False)
 def performance_by_id(performance_id):
     specific_performance_id = performance_id
     if request.method == 'GET':
@@ -213,51 +1109,45 @@ def performance_by_id(performance_id):
             specific_performance_id = int(specific_performance_id)
         except:
             return {'error': 'The provided performance ID must be a number.'}, 400
+        # The prepared statement takes a BIGINT, which no larger ID could fit.
+        if not BIGINT_MIN <= specific_performance_id <= BIGINT_MAX:
+            return {'error': 'No performance for the provided ID has been found.'}, 404
 
-
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(""" 
-                            SELECT pe.performance_id,
-                            per.performer_stagename AS "performer_names", 
-                            pe.performance_date,
-                            ve.venue_name,
-                            pe.review_score AS "review_score"
-                            FROM performance AS pe
-                            JOIN venue AS ve
-                            ON ve.venue_id = pe.venue_id 
-                            JOIN performance_performer_assignment AS ppai
-                            ON ppai.performance_id = pe.performance_id
-                            JOIN performer AS per
-                            ON ppai.performer_id = per.performer_id
-                            WHERE pe.performance_id = (%s)
-                            ORDER BY pe.performance_id ASC
-
+        # performance_detail holds each performance ready to return, kept
+        # current by triggers (see migration 0007).
+        if app.config["RENDER_JSON_IN_DATABASE"]:
+            response = database_json('performance_by_id_json', """
+                            SELECT json_build_object(
+                                'performance_id', performance_id,
+                                'performer_names', performer_names,
+                                'venue_name', venue_name,
+                                'performance_date', to_char(performance_date, 'YYYY-MM-DD'),
+                                'review_score', review_score
+                            )::TEXT AS "body"
+                            FROM performance_detail
+                            WHERE performance_id = (%s)
                     """, (specific_performance_id,))
-            response = cur.fetchall()
-            performer_names = []
-
-            # Iterate across the response to find all associated performers.
-            for row in response: 
-                performer_names.append(row['performer_names'])
-
-            # Format the response in the JSON structure specified in the README.
-            if response:
-                formatted_response = {
-                    'performance_id': response[0]['performance_id'],
-                    'performer_names': performer_names,
-                    'venue_name': response[0]['venue_name'],
-                    'performance_date': response[0]['performance_date'].strftime('%Y-%m-%d'),
-                    'review_score': response[0]['review_score']
-                }
-            else:
+            if response is None:
                 return {'error': 'No performance for the provided ID has been found.'}, 404
+            return response, 200
+
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'performance_by_id', """
+                            SELECT performance_id, performer_names, venue_name,
+                            performance_date, review_score
+                            FROM performance_detail
+                            WHERE performance_id = (%s)
+                    """, (specific_performance_id,))
+            response = cur.fetchone()
 
-            return jsonify(formatted_response), 200
-            # return jsonify(response)
+        if response is None:
+            return {'error': 'No performance for the provided ID has been found.'}, 404
+        return jsonify(response), 200
 
 
 
 @app.route('/performer_specialty', methods=['GET'])
+@cached_response('specialty', 'performer')
 def performer_specialty():
     """
     A poorly made, inefficient API route method
@@ -270,43 +1160,77 @@ def performer_specialty():
     - Performers(list of performer names)
     """
     if request.method == 'GET':
-    
-        query = """
-        SELECT s.specialty_id, s.specialty_name, 
-        ARRAY_AGG(p.performer_stagename) AS performer_names
+
+        # The fields ?fields= can choose from, and the column behind each.
+        field_column_map = {
+            'specialty_id': 's.specialty_id',
+            'specialty_name': 's.specialty_name',
+            'performer_names': 'ARRAY_AGG(p.performer_stagename)'
+        }
+        fields = requested_fields(field_column_map)
+        if fields is None:
+            return jsonify({'error': True, 'message': 'Invalid fields query parameter provided.'}), 400
+
+        select_list = ',\n        '.join(f'{field_column_map[field]} AS "{field}"' for field in fields)
+        query = f"""
+        SELECT {select_list}
         FROM specialty AS s
         JOIN performer p ON s.specialty_id = p.specialty_id
         GROUP BY s.specialty_id, s.specialty_name
-        ORDER BY s.specialty_id ASC;
+        ORDER BY s.specialty_id ASC
         """
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
+        statement_name = 'performer_specialty' + fields_suffix(field_column_map, fields)
+        if app.config["RENDER_JSON_IN_DATABASE"]:
+            return database_json_list(f'{statement_name}_json', query), 200
+
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, statement_name, query)
             response = cur.fetchall()
 
             return response, 200
 
 
 @app.route('/performers/summary', methods=['GET'])
+@cached_response('performer', 'performance_performer_assignment', 'performance')
 def performers_summary():
     
     if request.method == 'GET':
 
-        query = '''
-                    SELECT 
-                    p.performer_id,
-                    p.performer_stagename,
-                    COUNT(ppa.performance_id) AS total_performances,
-                    ROUND(AVG(perf.review_score), 2) AS average_review_score
-                    FROM performer p
-                    JOIN performance_performer_assignment ppa ON p.performer_id = ppa.performer_id
-                    JOIN performance perf ON ppa.performance_id = perf.performance_id
-                    GROUP BY p.performer_id, p.performer_stagename
-                    ORDER BY total_performances DESC;
+        # The fields ?fields= can choose from, and the column behind each.
+        field_column_map = {
+            'performer_id': 's.performer_id',
+            'performer_stagename': 'p.performer_stagename',
+            'total_performances': 's.total_performances',
+            'average_review_score':
+                'ROUND(s.review_score_sum::NUMERIC / NULLIF(s.scored_performances, 0), 2)::TEXT'
+        }
+        fields = requested_fields(field_column_map)
+        if fields is None:
+            return jsonify({'error': True, 'message': 'Invalid fields query parameter provided.'}), 400
+
+        # performer_summary is kept current by triggers (see migration 0005),
+        # so this is an indexed read rather than an aggregate over every performance.
+        select_list = ',\n                    '.join(f'{field_column_map[field]} AS "{field}"' for field in fields)
+        query = f'''
+                    SELECT {select_list}
+                    FROM performer_summary s
+                    JOIN performer p ON p.performer_id = s.performer_id
+                    WHERE s.total_performances > 0
+                    ORDER BY s.total_performances DESC, s.performer_id ASC
             '''
-        
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
+        statement_name = 'performers_summary' + fields_suffix(field_column_map, fields)
+
+        stream = wants_stream()
+        if stream is None:
+            return jsonify({'error': True, 'message': 'Invalid stream query parameter provided.'}), 400
+        if stream:
+            return stream_json_list(query)
+        if app.config["RENDER_JSON_IN_DATABASE"]:
+            return database_json_list(f'{statement_name}_json', query), 200
+
+        with get_db().cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, statement_name, query)
             response = cur.fetchall()
 
             return response, 200
@@ -319,5 +1243,5 @@ if __name__ == "__main__":
         app.config["TESTING"] = True
         app.run(port=8000)
     finally:
-        conn.close()
-        print("Connection closed")
+        close_pool()
+        print("Connection pool closed")
@@ -0,0 +1,60 @@
+"""
+Compares the JSON encoders responses can be written with.
+
+Payloads are built the way psycopg2 returns them (RealDictRows holding dates,
+Decimals and ints), shaped like the API's list responses.
+
+Usage: python bench_json.py [rows] [repeat]
+"""
+
+import sys
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import RealDictRow
+
+from serialization import ENCODERS
+
+
+def performances(rows):
+    """Rows like those of GET /performances."""
+    return [RealDictRow(performance_id=i // 2 + 1,
+                        performer_names=f"Performer {i % 97}",
+                        performance_date=date(1785, 1, 1) + timedelta(days=i),
+                        venue_name=f"Venue {i % 20}",
+                        score=i % 10) for i in range(rows)]
+
+
+def performers_summary(rows):
+    """Rows like those of GET /performers/summary, with the average left as a Decimal."""
+    return [RealDictRow(performer_id=i,
+                        performer_stagename=f"Performer {i}",
+                        total_performances=i % 40,
+                        average_review_score=Decimal(i % 1000) / 100) for i in range(rows)]
+
+
+def encoders():
+    """Returns every encoder to compare, including Flask's own default provider."""
+    flask_default = DefaultJSONProvider(Flask(__name__))
+    found = {"flask-default": lambda obj: flask_default.dumps(obj).encode()}
+    found.update(ENCODERS)
+    return found
+
+
+def main(rows=10000, repeat=20):
+    for name, payload in (("performances", performances(rows)),
+                          ("performers_summary", performers_summary(rows))):
+        print(f"{name} ({rows} rows)")
+        baseline = None
+        for encoder, dumps in encoders().items():
+            # Best of `repeat` runs, the least disturbed by anything else on the machine.
+            best = min(timeit.repeat(lambda: dumps(payload), number=1, repeat=repeat))
+            baseline = baseline or best
+            print(f"  {encoder:<14} {best * 1000:8.2f} ms  {baseline / best:5.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
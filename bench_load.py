@@ -0,0 +1,250 @@
+"""
+A load benchmark for every route of the API, run against a local Postgres.
+
+A fresh database of --scale times the size of setup-db.sql is generated (see
+generate_data.py). The app is then served from a child
+process and each route is hit by --concurrency clients. Per route the results
+hold throughput, p50/p95/p99 latency and how many statements a request ran
+(from the X-Query-Count header).
+
+Usage:
+    python bench_load.py [--scale N] [--concurrency N] [--requests N] [--output FILE]
+    python bench_load.py --save-baseline
+    python bench_load.py --compare bench_baseline.json [--tolerance 0.25]
+
+Latencies depend on the machine, so a baseline is only comparable with runs on
+the machine that recorded it. Query counts can be compared anywhere.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from werkzeug.serving import make_server
+
+from database_functions import get_connection
+from generate_data import generate
+
+
+BENCH_DATABASE = "bench_time_circus"
+BASELINE_FILE = "bench_baseline.json"
+
+
+def dataset_facts(dbname):
+    """Returns what the request generators need to know about the benchmark data."""
+    conn = get_connection(dbname)
+    with conn.cursor() as cur:
+        cur.execute("SELECT MAX(performance_id) AS max_id FROM performance")
+        max_performance_id = cur.fetchone()["max_id"]
+        cur.execute("SELECT array_agg(performer_id) AS ids FROM performer")
+        performer_ids = cur.fetchone()["ids"]
+        cur.execute("SELECT array_agg(venue_name) AS names FROM venue")
+        venue_names = cur.fetchone()["names"]
+    conn.close()
+    return {"max_performance_id": max_performance_id, "performer_ids": performer_ids,
+            "venue_names": venue_names}
+
+
+def new_performance(rng, facts):
+    return {"performer_id": rng.sample(facts["performer_ids"], 2),
+            "performance_date": f"{rng.randint(1000, 9999)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+            "venue_name": rng.choice(facts["venue_names"]),
+            "review_score": rng.randint(0, 100)}
+
+
+# (name, method, function of (rng, facts) returning (path, JSON body or None))
+ROUTES = [
+    ("GET /performers", "GET", lambda rng, facts: ("/performers", None)),
+    ("GET /performers?sort=performer_name", "GET",
+     lambda rng, facts: ("/performers?sort=performer_name&order=ascending", None)),
+    ("GET /performers?limit=20", "GET", lambda rng, facts: ("/performers?limit=20", None)),
+    ("GET /venues", "GET", lambda rng, facts: ("/venues", None)),
+    ("GET /performances", "GET", lambda rng, facts: ("/performances", None)),
+    ("GET /performances?group=performance", "GET",
+     lambda rng, facts: ("/performances?group=performance", None)),
+    ("GET /performances/<id>", "GET",
+     lambda rng, facts: (f"/performances/{rng.randint(1, facts['max_performance_id'])}", None)),
+    ("GET /performances?ids=", "GET",
+     lambda rng, facts: ("/performances?ids=" + ",".join(
+         str(rng.randint(1, facts['max_performance_id'])) for _ in range(50)), None)),
+    ("GET /performances?from=&to=", "GET",
+     lambda rng, facts: (f"/performances?from={rng.randint(1000, 9989)}-01-01&to={rng.randint(9990, 9999)}-12-31"
+                         f"&min_score={rng.randint(0, 50)}", None)),
+    ("GET /performances?venue_name=", "GET",
+     lambda rng, facts: (f"/performances?venue_name={quote(rng.choice(facts['venue_names']))}"
+                         f"&from={rng.randint(1000, 9999)}-01-01", None)),
+    ("GET /performer_specialty", "GET", lambda rng, facts: ("/performer_specialty", None)),
+    ("GET /performers/summary", "GET", lambda rng, facts: ("/performers/summary", None)),
+    ("POST /performances", "POST", lambda rng, facts: ("/performances", new_performance(rng, facts))),
+    ("POST /performances/batch", "POST",
+     lambda rng, facts: ("/performances/batch", [new_performance(rng, facts) for _ in range(50)])),
+]
+
+
+def serve(dbname, port, response_cache, ready):
+    """Runs the app in this (child) process until it is terminated."""
+    from api import app
+
+    app.config["DATABASE_NAME"] = dbname
+    app.config["QUERY_COUNT_HEADER"] = True
+    if not response_cache:
+        app.config["RESPONSE_CACHE_SIZE"] = 0
+    # One log line per request would cost more than some of the requests do.
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def send(base_url, method, path, body):
+    """Sends one request and returns (seconds taken, status, statements run)."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = Request(base_url + path, data=data, method=method,
+                  headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urlopen(req) as res:
+            res.read()
+            status, headers = res.status, res.headers
+    except HTTPError as error:
+        status, headers = error.code, error.headers
+    elapsed = time.perf_counter() - start
+    return elapsed, status, int(headers.get("X-Query-Count", 0))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_route(base_url, route, facts, concurrency, requests, warmup, seed):
+    name, method, make_request = route
+    rng = random.Random(f"{seed}:{name}")
+    planned = [make_request(rng, facts) for _ in range(warmup + requests)]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda r: send(base_url, method, *r), planned[:warmup]))
+        start = time.perf_counter()
+        samples = list(executor.map(lambda r: send(base_url, method, *r), planned[warmup:]))
+        wall_time = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, status, _ in samples if status >= 500),
+        "throughput_rps": round(requests / wall_time, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "queries_per_request": round(sum(count for _, _, count in samples) / requests, 2),
+    }
+
+
+def run(args):
+    generate(args.database, args.scale, args.seed)
+    facts = dataset_facts(args.database)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(args.database, args.port, args.response_cache, ready))
+    server.start()
+    ready.wait(30)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    results = {}
+    try:
+        for route in ROUTES:
+            if args.routes and not any(part in route[0] for part in args.routes):
+                continue
+            results[route[0]] = run_route(base_url, route, facts, args.concurrency,
+                                          args.requests, args.warmup, args.seed)
+            print(f"{route[0]:<40} {results[route[0]]['p50_ms']:8.2f} ms p50 "
+                  f"{results[route[0]]['p95_ms']:8.2f} ms p95 "
+                  f"{results[route[0]]['p99_ms']:8.2f} ms p99 "
+                  f"{results[route[0]]['throughput_rps']:8.1f} req/s "
+                  f"{results[route[0]]['queries_per_request']:5.1f} queries")
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        "config": {"scale": args.scale, "concurrency": args.concurrency, "requests": args.requests,
+                   "warmup": args.warmup, "seed": args.seed, "response_cache": args.response_cache,
+                   "python": platform.python_version(), "machine": platform.node()},
+        "routes": results,
+    }
+
+
+def find_regressions(baseline, current, tolerance):
+    """
+    Returns a description of every route that got slower or runs more
+    statements than its baseline, or has no baseline to be checked against.
+    """
+    regressions = []
+    for name, result in current["routes"].items():
+        base = baseline["routes"].get(name)
+        if base is None:
+            regressions.append(f"{name}: not in the baseline, re-record it with --save-baseline")
+            continue
+        if result["queries_per_request"] > base["queries_per_request"]:
+            regressions.append(f"{name}: {result['queries_per_request']} queries per request, "
+                               f"was {base['queries_per_request']}")
+        # p99 is reported but not checked, a couple of hundred samples make it too noisy.
+        for key in ("p50_ms", "p95_ms"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {result[key]}, was {base[key]}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors, was {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--scale", type=int, default=10,
+                        help="dataset size as a multiple of setup-db.sql")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per route")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--response-cache", action="store_true",
+                        help="leave the GET response cache on")
+    parser.add_argument("--routes", nargs="*", help="only run routes whose name contains one of these")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"also write the results to {BASELINE_FILE}")
+    parser.add_argument("--compare", metavar="BASELINE", help="fail if results regressed from BASELINE")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower p50/p95 may be than the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run(args)
+    for path in [args.output] + ([BASELINE_FILE] if args.save_baseline else []):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(baseline, results, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
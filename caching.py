@@ -0,0 +1,198 @@
+"""In-process caches sitting in front of the database"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2 import Error as DatabaseError
+from psycopg2.extensions import connection
+
+from database_functions import DEFAULT_DSN, get_connection, execute_prepared
+
+
+class VenueCache:
+    """
+    A bounded map of venue names to venue IDs.
+
+    The venue table is loaded on first use and kept until Postgres announces
+    a change on the venue_changed channel (see migration 0003), so looking a
+    venue up on the write path normally costs no round trip. Names that are
+    not cached are still looked up in the database.
+    """
+
+    def __init__(self, dbname, max_size=10000, dsn=DEFAULT_DSN):
+        self.dbname = dbname
+        self.max_size = max_size
+        # Notifications are not replicated, so this must be the primary.
+        self.dsn = dsn
+
+        self._lock = threading.Lock()
+        self._venues = {}
+        self._loaded = False
+        self._listener = None
+        # Bumped on every invalidation, so a lookup that raced with one
+        # never writes what it read back into the fresh cache.
+        self._generation = 0
+
+    def _invalidate(self):
+        self._venues = {}
+        self._loaded = False
+        self._generation += 1
+
+    def _check_for_changes(self):
+        """Drops the cache if a venue changed, or if we could have missed a change."""
+        if self._listener is not None:
+            try:
+                # poll() only reads what the server has already sent us,
+                # it does not make a round trip.
+                self._listener.poll()
+            except DatabaseError:
+                self._listener.close()
+                self._listener = None
+
+        if self._listener is None:
+            self._invalidate()
+            try:
+                self._listener = get_connection(self.dbname, dsn=self.dsn)
+                self._listener.autocommit = True
+                with self._listener.cursor() as cur:
+                    cur.execute("LISTEN venue_changed")
+            except DatabaseError:
+                # Without notifications we cannot know when to invalidate,
+                # so nothing is cached until listening works again.
+                if self._listener is not None:
+                    self._listener.close()
+                self._listener = None
+        elif self._listener.notifies:
+            self._listener.notifies.clear()
+            self._invalidate()
+
+    def lookup(self, conn: connection, venue_names) -> dict:
+        """Returns {venue_name: venue_id} for each of venue_names that exists."""
+        with self._lock:
+            self._check_for_changes()
+            caching = self._listener is not None
+            load = caching and not self._loaded
+            generation = self._generation
+            found = {name: self._venues[name] for name in venue_names if name in self._venues}
+
+        missing = list({name for name in venue_names if name not in found})
+        if not missing:
+            return found
+
+        with conn.cursor() as cur:
+            if load:
+                execute_prepared(cur, 'venue_cache_load',
+                                 "SELECT venue_name, venue_id FROM venue ORDER BY venue_id LIMIT %s",
+                                 (self.max_size,))
+                loaded = {row['venue_name']: row['venue_id'] for row in cur.fetchall()}
+                missing = [name for name in missing if name not in loaded]
+            else:
+                loaded = {}
+            if missing:
+                execute_prepared(cur, 'venue_lookup',
+                                 "SELECT venue_name, venue_id FROM venue WHERE venue_name = ANY(%s)",
+                                 (missing,))
+                loaded.update({row['venue_name']: row['venue_id'] for row in cur.fetchall()})
+
+        with self._lock:
+            if caching and generation == self._generation:
+                self._loaded = self._loaded or load
+                for name, venue_id in loaded.items():
+                    if len(self._venues) >= self.max_size:
+                        break
+                    self._venues[name] = venue_id
+
+        found.update({name: loaded[name] for name in venue_names if name in loaded})
+        return found
+
+    def close(self):
+        with self._lock:
+            if self._listener is not None:
+                self._listener.close()
+                self._listener = None
+            self._invalidate()
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of rendered responses, each kept for at most `ttl` seconds.
+
+    Every entry records the tables its response was built from, so a write
+    only has to invalidate the entries that read the tables it touched. Each
+    table also has a generation, bumped by every invalidation, so a response
+    read before a write but stored after it is never cached (see set()).
+    The cache lives in one process; writes made by other processes are only
+    picked up once the TTL runs out.
+    """
+
+    def __init__(self, max_entries=256, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, tag=None):
+        """
+        Returns the value cached under key, or None if it is missing or expired.
+        When a tag is given, entries stored under a different tag count as missing.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] <= time.monotonic()
+                    or (tag is not None and entry[3] != tag)):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def generation(self, tables) -> dict:
+        """Returns the generation of each of the tables, to be read before building a response."""
+        with self._lock:
+            return {table: self._generations.get(table, 0) for table in tables}
+
+    def set(self, key, tables, value, tag=None, generation=None):
+        """
+        Stores value under key. When a generation from generation() is given,
+        nothing is stored if any of its tables has been invalidated since, as
+        the value may have been read before the write that invalidated them.
+        """
+        with self._lock:
+            if generation is not None and any(self._generations.get(table, 0) != seen
+                                              for table, seen in generation.items()):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, frozenset(tables), value, tag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        """Drops every entry built from any of the given tables."""
+        tables = set(tables)
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry[1] & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
@@ -0,0 +1,42 @@
+"""Content-Encoding negotiation and compression for API responses."""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, clients asking for it get gzip without it.
+    brotli = None
+
+
+def compress_gzip(body, level) -> bytes:
+    # mtime=0 keeps the output the same for the same body, like the ETag.
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_brotli(body, level) -> bytes:
+    # Brotli's quality goes up to 11, but past 9 it is far slower for little gain.
+    return brotli.compress(body, quality=level, mode=brotli.MODE_TEXT)
+
+
+# The encodings responses can be sent in, by Content-Encoding token, most
+# preferred first. Clients that rank several equally get the first of them.
+ENCODINGS = {}
+if brotli is not None:
+    ENCODINGS["br"] = compress_brotli
+ENCODINGS["gzip"] = compress_gzip
+
+
+def negotiate(accept_encodings, available=None):
+    """
+    Returns the encoding to compress a response with, given the request's
+    parsed Accept-Encoding header, or None if it should be sent as it is.
+    """
+    available = list(ENCODINGS if available is None else available)
+    # identity scores like any encoding, so a client preferring it gets it.
+    best = accept_encodings.best_match(available + ["identity"])
+    return best if best in available else None
+
+
+def compress(body, encoding, level) -> bytes:
+    return ENCODINGS[encoding](body, level)
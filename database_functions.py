@@ -1,16 +1,442 @@
-from psycopg2 import connect
-from psycopg2.extensions import cursor, connection
+import logging
+import random
+import re
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+from psycopg2 import connect, Error as DatabaseError, OperationalError
+from psycopg2.extensions import (cursor, connection, parse_dsn,
+                                 TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN)
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+
+
+slow_query_log = logging.getLogger("database_functions.slow_queries")
+
+# The server connections go to unless told otherwise. A DSN names a server
+# (host, port, user and so on); the database is always passed separately.
+DEFAULT_DSN = "host=localhost port=5432"
+
+# Statements that can be re-run under EXPLAIN ANALYZE without changing anything.
+# Sequence and notification functions are excluded: a rolled back savepoint
+# does not undo them.
+READ_ONLY_STATEMENT = re.compile(r"^\s*(SELECT|VALUES|TABLE)\b", re.IGNORECASE)
+NOT_UNDONE_BY_ROLLBACK = re.compile(r"\b(nextval|setval|pg_notify|pg_advisory\w*)\s*\(", re.IGNORECASE)
+
+
+def explain(conn: connection, query, vars=None) -> str:
+    """
+    Runs a read-only query again under EXPLAIN (ANALYZE, BUFFERS) and returns its plan.
+
+    The query runs in a savepoint that is always rolled back, so locks it
+    takes are let go and a failure does not abort the caller's transaction.
+    """
+    in_transaction = conn.get_transaction_status() != TRANSACTION_STATUS_IDLE
+    # A plain cursor, so the EXPLAIN is not counted as work done by the request.
+    with connection.cursor(conn, cursor_factory=cursor) as cur:
+        if in_transaction:
+            cur.execute("SAVEPOINT explain_slow_query")
+        try:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", vars)
+            return "\n".join(row[0] for row in cur.fetchall())
+        except DatabaseError as error:
+            return f"EXPLAIN failed: {error}".strip()
+        finally:
+            if in_transaction:
+                cur.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+                cur.execute("RELEASE SAVEPOINT explain_slow_query")
+
+
+def can_explain(query) -> bool:
+    if not isinstance(query, str):
+        return False
+    # Prepared statements are looked up to see what they run.
+    words = query.split(None, 2)
+    if len(words) >= 2 and words[0].upper() == "EXECUTE":
+        query = statements.sql(words[1]) or ""
+    return bool(READ_ONLY_STATEMENT.match(query)) and not NOT_UNDONE_BY_ROLLBACK.search(query)
+
+
+def log_slow_query(cur: cursor, query, vars, seconds):
+    """Logs a statement that took at least the connection's slow_query_threshold, maybe with its plan."""
+    conn = cur.connection
+    plan = None
+    if (conn.explain_sample_rate and random.random() < conn.explain_sample_rate
+            and cur.name is None and can_explain(query)):
+        plan = explain(conn, query, vars)
+
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    slow_query_log.warning("Slow query (%.1f ms, %s rows) during %s: %s; params: %r%s",
+                           seconds * 1000, cur.rowcount, conn.context or "no request",
+                           " ".join(str(query).split()), vars, f"\n{plan}" if plan else "")
+
+
+@lru_cache(maxsize=None)
+def counting_cursor(cursor_class):
+    """
+    Returns a subclass of cursor_class that tallies its statements, the time
+    spent on them and the rows fetched, on its connection.
+
+    Statements slower than the connection's slow_query_threshold are logged
+    to the database_functions.slow_queries logger.
+    """
+
+    class CountingCursor(cursor_class):
+        def _timed(self, method, *args):
+            started = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.connection.query_time += time.perf_counter() - started
+
+        def _statement(self, method, query, vars):
+            self.connection.query_count += 1
+            started = time.perf_counter()
+            result = self._timed(method, query, vars)
+            seconds = time.perf_counter() - started
+            threshold = self.connection.slow_query_threshold
+            if threshold is not None and seconds >= threshold:
+                log_slow_query(self, query, vars, seconds)
+            return result
+
+        def execute(self, query, vars=None):
+            return self._statement(super().execute, query, vars)
+
+        def executemany(self, query, vars_list):
+            return self._statement(super().executemany, query, vars_list)
 
+        # Named (server-side) cursors go back to the server on fetches, so
+        # those are timed as well.
+        def fetchone(self):
+            row = self._timed(super().fetchone)
+            if row is not None:
+                self.connection.rows_fetched += 1
+            return row
 
-def get_connection(dbname, password="postgres") -> connection:
+        def fetchmany(self, size=None):
+            rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+            self.connection.rows_fetched += len(rows)
+            return rows
+
+        def fetchall(self):
+            rows = self._timed(super().fetchall)
+            self.connection.rows_fetched += len(rows)
+            return rows
+
+    CountingCursor.__name__ = f"Counting{cursor_class.__name__}"
+    return CountingCursor
+
+
+class CountingConnection(connection):
+    """
+    A connection that keeps running totals of the work done through its cursors:
+    statements in query_count, seconds spent on them in query_time and rows
+    fetched in rows_fetched.
+
+    The totals only ever go up, callers take the difference between two reads.
+    """
+
+    # Statements taking at least this many seconds are logged, None logs none.
+    slow_query_threshold = None
+    # The share of logged (read-only) statements whose plan is captured too.
+    explain_sample_rate = 0.0
+    # What the connection is being used for, such as the current request, for the log.
+    context = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_count = 0
+        self.query_time = 0.0
+        self.rows_fetched = 0
+
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        cursor_class = cursor_factory or self.cursor_factory or cursor
+        return super().cursor(name, cursor_factory=counting_cursor(cursor_class), **kwargs)
+
+
+def get_connection(dbname, password="postgres", dsn=DEFAULT_DSN) -> connection:
+    """Connects to dbname on the server dsn names; a password in the DSN wins over `password`."""
+    # Passed as a keyword, psycopg2 quotes the password, so any characters work.
+    kwargs = {} if "password" in parse_dsn(dsn) else {"password": password}
     return connect(
+        dsn,
         dbname=dbname,
-        host="localhost",
-        port=5432,
-        password=password,
-        cursor_factory=RealDictCursor)
+        connection_factory=CountingConnection,
+        cursor_factory=RealDictCursor,
+        **kwargs)
 
 
 def get_cursor(connection: connection) -> cursor:
     return connection.cursor()
+
+
+def allocate_ids(cur: cursor, table: str, column: str, count: int) -> list:
+    """
+    Reserves `count` values from the identity sequence of table.column in one round trip.
+
+    Bulk writers use this to know their IDs before inserting. The values are
+    unique even with other writers running, but are not always contiguous.
+    """
+    cur.execute("""
+        SELECT nextval(pg_get_serial_sequence(%s, %s)) AS id
+        FROM generate_series(1, %s)
+        """, (table, column, count))
+    return [row['id'] for row in cur.fetchall()]
+
+
+class PreparedStatements:
+    """
+    A registry of named queries, each prepared on the server at most once per connection.
+
+    Queries are written with the usual %s or %(name)s placeholders and are
+    turned into PREPARE ... AS ... with $n parameters when first run on a
+    connection. After that every run is a short EXECUTE, skipping parsing and
+    planning. New connections (after a reconnect, say) start with nothing
+    prepared, so statements are prepared again the first time they are used.
+    """
+
+    PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+    NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (sql with $n parameters, parameter names or None for positional)
+        self._statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+
+    def register(self, name, sql):
+        """Registers a query under a name; registering the same query again is a no-op."""
+        if not self.NAME.match(name):
+            raise ValueError(f"{name!r} is not a valid statement name.")
+
+        names = []
+        positional = []
+
+        def to_parameter(match):
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(1) is None:
+                positional.append(None)
+                return f"${len(positional)}"
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f"${names.index(match.group(1)) + 1}"
+
+        prepared_sql = self.PLACEHOLDER.sub(to_parameter, sql).strip().rstrip(';')
+        if names and positional:
+            raise ValueError(f"Statement {name} mixes named and positional placeholders.")
+        statement = (prepared_sql, names or None)
+
+        with self._lock:
+            if self._statements.setdefault(name, statement) != statement:
+                raise ValueError(f"Statement {name} is already registered with different SQL.")
+
+    def sql(self, name):
+        """Returns the SQL registered under name, with $n parameters, or None."""
+        statement = self._statements.get(name)
+        return statement[0] if statement is not None else None
+
+    def execute(self, cur: cursor, name, params=None):
+        """Runs a registered statement on cur's connection, preparing it there first if needed."""
+        prepared_sql, names = self._statements[name]
+        with self._lock:
+            prepared = self._prepared.setdefault(cur.connection, set())
+
+        if name not in prepared:
+            # % in the SQL is already unescaped, so it must not go through parameter formatting.
+            cur.execute(f"PREPARE {name} AS {prepared_sql}".replace('%', '%%'), ())
+            prepared.add(name)
+
+        if names is not None:
+            params = [params[param] for param in names]
+        params = list(params or [])
+        if params:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+
+# The registry every query in the API goes through.
+statements = PreparedStatements()
+
+
+def execute_prepared(cur: cursor, name, sql, params=None):
+    """Registers sql under name if it is new, then runs it as a prepared statement."""
+    statements.register(name, sql)
+    statements.execute(cur, name, params)
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of connections to a single database.
+
+    Connections are health checked when they are checked out and rolled back
+    when they are returned, so a failed statement in one request can never
+    leave an aborted transaction behind for the next one.
+    """
+
+    def __init__(self, dbname, min_size=1, max_size=10, password="postgres",
+                 timeout=30.0, ping_after=30.0, dsn=DEFAULT_DSN):
+        self.dbname = dbname
+        self.password = password
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        # How long getconn() waits for a free connection before giving up.
+        self.timeout = timeout
+        # Connections idle for longer than this are pinged before being handed out.
+        self.ping_after = ping_after
+
+        self._lock = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self) -> connection:
+        return get_connection(self.dbname, self.password, self.dsn)
+
+    def _is_healthy(self, conn: connection, last_used: float) -> bool:
+        if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        # Recently used connections are trusted, anything older gets a round trip
+        # to catch servers that have restarted or dropped us in the meantime.
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except DatabaseError:
+            return False
+
+    def getconn(self) -> connection:
+        """Checks out a healthy connection, waiting up to `timeout` seconds for one."""
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed.")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(
+                            f"No connection to {self.dbname} became free within {self.timeout}s.")
+                    self._lock.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn: connection) -> None:
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        healthy = not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_UNKNOWN
+        if healthy and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except DatabaseError:
+                healthy = False
+
+        if not healthy:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, conn) -> None:
+        if conn is not None and not conn.closed:
+            conn.close()
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def closeall(self) -> None:
+        """Closes every idle connection; checked out ones are closed when returned."""
+        with self._lock:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+                self._size -= 1
+            self._idle = []
+            self._lock.notify_all()
+
+
+class ReplicaSet:
+    """
+    Hands out connections from a set of replica pools in turn (round-robin).
+
+    A replica that cannot be connected to is skipped for `retry_after`
+    seconds, and if none of them can serve, the connection comes from the
+    primary pool instead. A replica that is only busy (its pool timed out)
+    is skipped for this checkout but not marked down.
+    """
+
+    def __init__(self, pools, primary: ConnectionPool, retry_after=30.0):
+        self.pools = list(pools)
+        self.primary = primary
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = {}
+
+    def getconn(self):
+        """Returns (pool, connection); the connection must be given back to that pool."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.pools), 1)
+
+        now = time.monotonic()
+        for offset in range(len(self.pools)):
+            pool = self.pools[(start + offset) % len(self.pools)]
+            if self._down_until.get(pool, 0) > now:
+                continue
+            try:
+                conn = pool.getconn()
+            except OperationalError:
+                self._down_until[pool] = time.monotonic() + self.retry_after
+                continue
+            except PoolError:
+                continue
+            self._down_until.pop(pool, None)
+            return pool, conn
+
+        return self.primary, self.primary.getconn()
+
+    def down(self) -> list:
+        """Returns the replica pools currently being skipped."""
+        now = time.monotonic()
+        return [pool for pool in self.pools if self._down_until.get(pool, 0) > now]
+
+    def closeall(self) -> None:
+        for pool in self.pools:
+            pool.closeall()
@@ -0,0 +1,298 @@
+"""
+Generates a synthetic circus database of any size and bulk loads it with COPY.
+
+At scale 1 there are as many performers (50), venues (20) and performances
+(100) as in setup-db.sql, and every table grows linearly with the scale. The
+data is shaped like the real thing rather than uniform:
+- a few performers and venues are far more popular than the rest (Zipf),
+- most shows have one or two performers, some up to five,
+- dates are spread over ten millennia, bunched around the present day,
+- review scores cluster in the high 80s and a few shows are never scored.
+
+The database is created from setup-db.sql and the migrations, emptied, and
+loaded with indexes, constraints and triggers out of the way. Those are put
+back afterwards, and the tables the triggers maintain are rebuilt.
+
+Usage: python generate_data.py [--scale N] [--seed N] dbname
+
+dbname is dropped and recreated, so there is no default: name a scratch
+database such as bench_time_circus, never one holding data to keep.
+"""
+
+import argparse
+import io
+import math
+import random
+import time
+from itertools import accumulate
+
+from psycopg2.extensions import connection
+
+from admin import rebuild_performance_detail, rebuild_performer_summary
+from database_functions import get_connection
+from migrate import apply_migrations
+
+
+PERFORMERS_PER_SCALE = 50
+VENUES_PER_SCALE = 20
+PERFORMANCES_PER_SCALE = 100
+
+# Weights of shows having 1, 2, 3, 4 and 5 performers.
+PERFORMERS_PER_SHOW_WEIGHTS = [45, 35, 12, 6, 2]
+# Zipf exponents; higher means the most popular get a bigger share.
+PERFORMER_POPULARITY = 1.1
+VENUE_POPULARITY = 0.8
+UNSCORED_SHARE = 0.05
+
+# Rows written per COPY, which bounds how much is held in memory at a time.
+COPY_CHUNK_ROWS = 200_000
+# Random choices are drawn this many at a time, one call being much cheaper than many.
+DRAW_BLOCK = 10_000
+
+# The tables the generator fills, parents first.
+LOADED_TABLES = ["performer", "venue", "performance", "performance_performer_assignment"]
+
+STAGE_NAME_TITLES = ["Astro", "Chrono", "Cosmic", "Dazzling", "Electric", "Fearless", "Galactic",
+                     "Infinite", "Mystic", "Nimble", "Paradox", "Quantum", "Radiant", "Spectral",
+                     "Temporal", "Vertigo", "Warp", "Zesty"]
+STAGE_NAME_NAMES = ["Ada", "Barry", "Callie", "Dan", "Ella", "Felix", "Gina", "Hedley", "Ian",
+                    "Kelly", "Max", "Nick", "Orac", "Petra", "Quentin", "Sara", "Tom", "Willow"]
+VENUE_PLACES = ["Amphitheatre", "Arena", "Big Top", "Colosseum", "Dome", "Exhibition Hall",
+                "Grounds", "Hub", "Oasis", "Pavilion", "Stage", "Theater"]
+VENUE_SETTINGS = ["Atlantis", "Desert", "Futuristic", "Galactic", "Jungle", "Lunar", "Martian",
+                  "Medieval", "Renaissance", "Roman", "Underwater", "Victorian"]
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights for random.choices, where item i is picked in proportion to 1/(i+1)^exponent."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def review_score_weights():
+    """Weights of each review score (None for unscored, then 0 to 100), normal around 88."""
+    scored = [math.exp(-((score - 88) / 6) ** 2 / 2) for score in range(101)]
+    return [UNSCORED_SHARE] + [(1 - UNSCORED_SHARE) * weight / sum(scored) for weight in scored]
+
+
+def time_travel_date(rng) -> str:
+    # Years run from 1 to 9999 but most shows are within a few centuries of now.
+    year = int(rng.triangular(1, 9999, 2024))
+    return f"{year:04}-{1 + int(rng.random() * 12):02}-{1 + int(rng.random() * 28):02}"
+
+
+def numbered(names, i) -> str:
+    """The i-th name, cycling through names and numbering each cycle after the first."""
+    name = names[i % len(names)]
+    return name if i < len(names) else f"{name} {i // len(names) + 1}"
+
+
+def generate_performers(rng, count, specialty_ids):
+    names = [f"{title} {name}" for title in STAGE_NAME_TITLES for name in STAGE_NAME_NAMES]
+    rng.shuffle(names)
+    for i in range(count):
+        yield (i + 1, numbered(names, i), time_travel_date(rng), rng.choice(specialty_ids))
+
+
+def generate_venues(rng, count):
+    names = [f"{setting} {place}" for setting in VENUE_SETTINGS for place in VENUE_PLACES]
+    rng.shuffle(names)
+    for i in range(count):
+        yield (i + 1, numbered(names, i))
+
+
+def generate_performances(rng, count, venue_count):
+    # Which venues are popular is random, rather than always the lowest IDs.
+    venues = list(range(1, venue_count + 1))
+    rng.shuffle(venues)
+    cum_weights = zipf_cum_weights(venue_count, VENUE_POPULARITY)
+    scores = [None] + list(range(101))
+    score_cum_weights = list(accumulate(review_score_weights()))
+    for first_id in range(1, count + 1, DRAW_BLOCK):
+        block = min(DRAW_BLOCK, count + 1 - first_id)
+        venue_ids = rng.choices(venues, cum_weights=cum_weights, k=block)
+        block_scores = rng.choices(scores, cum_weights=score_cum_weights, k=block)
+        for performance_id, venue_id, score in zip(range(first_id, first_id + block), venue_ids, block_scores):
+            yield (performance_id, venue_id, time_travel_date(rng), score)
+
+
+def generate_assignments(rng, performance_count, performer_count):
+    performers = list(range(1, performer_count + 1))
+    rng.shuffle(performers)
+    cum_weights = zipf_cum_weights(performer_count, PERFORMER_POPULARITY)
+    sizes = range(1, min(len(PERFORMERS_PER_SHOW_WEIGHTS), performer_count) + 1)
+    size_weights = PERFORMERS_PER_SHOW_WEIGHTS[:len(sizes)]
+
+    assignment_id = 0
+    for first_id in range(1, performance_count + 1, DRAW_BLOCK):
+        block = min(DRAW_BLOCK, performance_count + 1 - first_id)
+        cast_sizes = rng.choices(sizes, size_weights, k=block)
+        picks = iter(rng.choices(performers, cum_weights=cum_weights, k=sum(cast_sizes)))
+        for performance_id, size in enumerate(cast_sizes, first_id):
+            cast = {next(picks) for _ in range(size)}
+            # A performer can only appear once per show, so redraw any repeats.
+            while len(cast) < size:
+                cast.update(rng.choices(performers, cum_weights=cum_weights, k=size - len(cast)))
+            for performer_id in cast:
+                assignment_id += 1
+                yield (assignment_id, performer_id, performance_id)
+
+
+def copy_rows(cur, table, columns, rows) -> int:
+    """COPYs rows into table in chunks and returns how many were written."""
+    written = 0
+    while True:
+        buffer = io.StringIO()
+        chunk = 0
+        for row in rows:
+            buffer.write("\t".join(r"\N" if value is None else str(value) for value in row))
+            buffer.write("\n")
+            chunk += 1
+            if chunk == COPY_CHUNK_ROWS:
+                break
+        if not chunk:
+            return written
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+        written += chunk
+
+
+def create_schema(dbname):
+    """(Re)creates dbname with the tables, migrations and seed specialties but no other rows."""
+    conn = get_connection("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {dbname} WITH (FORCE);")
+        cur.execute(f"CREATE DATABASE {dbname};")
+    conn.close()
+
+    conn = get_connection(dbname)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        with open("setup-db.sql", 'r') as f:
+            for q in f.read().split("\n\n"):
+                cur.execute(q)
+    conn.autocommit = False
+    apply_migrations(conn)
+    with conn, conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(LOADED_TABLES)} CASCADE")
+    conn.close()
+
+
+def drop_indexes_and_constraints(cur) -> list:
+    """
+    Drops the keys, foreign keys and indexes of the loaded tables and
+    returns the statements that put them back, in the order to run them.
+    """
+    cur.execute("""
+        SELECT format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s', c.conrelid::regclass, c.conname,
+                      pg_get_constraintdef(c.oid)) AS restore,
+        format('ALTER TABLE %%s DROP CONSTRAINT %%I', c.conrelid::regclass, c.conname) AS drop,
+        c.contype
+        FROM pg_constraint AS c
+        WHERE c.conrelid = ANY(%(tables)s::regclass[]) AND c.contype IN ('p', 'u', 'f')
+        """, {"tables": LOADED_TABLES})
+    constraints = cur.fetchall()
+    cur.execute("""
+        SELECT pg_get_indexdef(i.indexrelid) AS restore,
+        format('DROP INDEX %%s', i.indexrelid::regclass) AS drop
+        FROM pg_index AS i
+        WHERE i.indrelid = ANY(%(tables)s::regclass[])
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conindid = i.indexrelid)
+        """, {"tables": LOADED_TABLES})
+    indexes = cur.fetchall()
+
+    # Foreign keys (including those of other tables onto these) go first, as
+    # they depend on the keys they reference.
+    foreign_keys = [c for c in constraints if c["contype"] == "f"]
+    keys = [c for c in constraints if c["contype"] != "f"]
+    cur.execute("""
+        SELECT format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s', c.conrelid::regclass, c.conname,
+                      pg_get_constraintdef(c.oid)) AS restore,
+        format('ALTER TABLE %%s DROP CONSTRAINT %%I', c.conrelid::regclass, c.conname) AS drop
+        FROM pg_constraint AS c
+        WHERE c.confrelid = ANY(%(tables)s::regclass[]) AND c.contype = 'f'
+        AND NOT c.conrelid = ANY(%(tables)s::regclass[])
+        """, {"tables": LOADED_TABLES})
+    foreign_keys += cur.fetchall()
+
+    for statement in foreign_keys + keys + indexes:
+        cur.execute(statement["drop"])
+    return [statement["restore"] for statement in keys + indexes + foreign_keys]
+
+
+def load(conn: connection, scale, seed=0) -> dict:
+    """Fills the (empty) loaded tables with generated data and returns the row count of each."""
+    rng = random.Random(seed)
+    performer_count = PERFORMERS_PER_SCALE * scale
+    venue_count = VENUES_PER_SCALE * scale
+    performance_count = PERFORMANCES_PER_SCALE * scale
+
+    with conn, conn.cursor() as cur:
+        cur.execute("SET LOCAL maintenance_work_mem = '512MB'")
+        cur.execute("SET LOCAL synchronous_commit = off")
+        cur.execute("SELECT array_agg(specialty_id) AS ids FROM specialty")
+        specialty_ids = cur.fetchone()["ids"]
+
+        restore = drop_indexes_and_constraints(cur)
+        for table in LOADED_TABLES:
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+        counts = {
+            "performer": copy_rows(cur, "performer",
+                                   ["performer_id", "performer_stagename", "performer_dob", "specialty_id"],
+                                   generate_performers(rng, performer_count, specialty_ids)),
+            "venue": copy_rows(cur, "venue", ["venue_id", "venue_name"], generate_venues(rng, venue_count)),
+            "performance": copy_rows(cur, "performance",
+                                     ["performance_id", "venue_id", "performance_date", "review_score"],
+                                     generate_performances(rng, performance_count, venue_count)),
+            "performance_performer_assignment": copy_rows(
+                cur, "performance_performer_assignment",
+                ["performance_performer_assignment_id", "performer_id", "performance_id"],
+                generate_assignments(rng, performance_count, performer_count)),
+        }
+
+        for statement in restore:
+            cur.execute(statement)
+        for table in LOADED_TABLES:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+
+        # IDs were written explicitly, so the identity sequences must be moved past them.
+        for table, column in (("performance", "performance_id"),
+                              ("performance_performer_assignment", "performance_performer_assignment_id")):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                        f"(SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}), false)")
+        # The triggers that keep these up to date were off during the load.
+        cur.execute("UPDATE table_version SET version = version + 1 WHERE shard = 0")
+        cur.execute("SELECT pg_notify('venue_changed', 'COPY')")
+
+    rebuild_performer_summary(conn)
+    rebuild_performance_detail(conn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+    return counts
+
+
+def generate(dbname, scale, seed=0) -> dict:
+    """Creates dbname holding a generated dataset of the given scale."""
+    create_schema(dbname)
+    conn = get_connection(dbname)
+    try:
+        return load(conn, scale, seed)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("dbname", help="the database to drop and recreate")
+    parser.add_argument("--scale", type=int, default=1, help="1 is the size of setup-db.sql, up to 100000")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed always generates the same data")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    counts = generate(args.dbname, args.scale, args.seed)
+    for table, count in counts.items():
+        print(f"{table:<34} {count:>12,} rows")
+    print(f"Loaded {args.dbname} in {time.monotonic() - started:.1f}s.")
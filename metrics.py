@@ -0,0 +1,96 @@
+"""Per-route request metrics, rendered in the Prometheus text format"""
+
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteStats:
+    """Running totals for one route and method."""
+
+    def __init__(self):
+        self.requests_by_status = defaultdict(int)
+        # Observations per bucket (not cumulative), the last is +Inf.
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows_fetched = 0
+        self.response_bytes = 0
+
+
+class RequestMetrics:
+    """
+    Thread-safe totals of what requests cost, per route.
+
+    Like the caches these live in the process, so with several worker
+    processes each one reports its own; Prometheus sums them per instance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(RouteStats)
+
+    def observe(self, route, method, status, seconds, db_seconds=0.0, queries=0,
+                rows_fetched=0, response_bytes=0):
+        """Records one finished request."""
+        with self._lock:
+            stats = self._routes[(route, method)]
+            stats.requests_by_status[status] += 1
+            stats.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.latency_sum += seconds
+            stats.db_seconds += db_seconds
+            stats.queries += queries
+            stats.rows_fetched += rows_fetched
+            stats.response_bytes += response_bytes
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP http_requests_total Requests handled, by route, method and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.requests_by_status.items()):
+                    lines.append(f'http_requests_total{{{labels(route, method)},status="{status}"}} {count}')
+
+            lines += [
+                "# HELP http_request_duration_seconds Time from a request arriving to its response being returned.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (route, method), stats in routes:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.latency_buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels(route, method)},le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels(route, method)}}} {stats.latency_sum}")
+                lines.append(f"http_request_duration_seconds_count{{{labels(route, method)}}} {cumulative}")
+
+            for name, attribute, kind, description in (
+                    ("http_request_db_seconds_total", "db_seconds", "counter",
+                     "Time spent running statements and fetching rows."),
+                    ("http_request_queries_total", "queries", "counter", "Statements run."),
+                    ("http_request_rows_fetched_total", "rows_fetched", "counter", "Rows fetched from the database."),
+                    ("http_response_bytes_total", "response_bytes", "counter",
+                     "Response body bytes, where the length was known up front.")):
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                for (route, method), stats in routes:
+                    lines.append(f"{name}{{{labels(route, method)}}} {getattr(stats, attribute)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(route, method) -> str:
+    escaped = route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'route="{escaped}",method="{method}"'
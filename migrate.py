@@ -0,0 +1,139 @@
+"""Applies the versioned schema migrations in migrations/ to a database"""
+
+import argparse
+import os
+import re
+
+from psycopg2.extensions import connection
+
+from database_functions import get_connection
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Migration files are named <version>_<name>.sql, e.g. 0002_join_and_lookup_indexes.sql
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Held while a migration is applied, so two runners can never apply the same one.
+MIGRATION_LOCK_ID = 57_300_001
+
+# A migration starting with this line runs outside a transaction, one
+# statement at a time, for statements Postgres refuses to run in one such as
+# CREATE INDEX CONCURRENTLY. Each statement must be safe to run again, as a
+# failure part way through leaves the earlier ones applied.
+NO_TRANSACTION_HEADER = "-- migrate: no-transaction"
+
+
+def find_migrations(directory=MIGRATIONS_DIR) -> list:
+    """Returns (version, name, path) for every migration file, in version order."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}.")
+    return migrations
+
+
+def applied_versions(conn: connection) -> set:
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+                """)
+            cur.execute("SELECT version FROM schema_migrations")
+            return {row['version'] for row in cur.fetchall()}
+
+
+def split_statements(sql: str) -> list:
+    """Splits a migration into its statements. Only for migrations without function bodies or quoted semicolons."""
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def apply_migrations(conn: connection, directory=MIGRATIONS_DIR) -> list:
+    """
+    Applies every migration not yet recorded in schema_migrations, oldest first.
+
+    Each migration runs in its own transaction together with the row that
+    records it, so a failed migration leaves nothing half applied. Migrations
+    starting with NO_TRANSACTION_HEADER are the exception.
+    Returns the versions that were applied.
+    """
+    applied = applied_versions(conn)
+    newly_applied = []
+
+    for version, name, path in find_migrations(directory):
+        if version in applied:
+            continue
+        with open(path, 'r') as f:
+            sql = f.read()
+
+        if sql.startswith(NO_TRANSACTION_HEADER):
+            if apply_without_transaction(conn, version, name, sql):
+                newly_applied.append(version)
+            continue
+
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                # Another runner may have applied it while we waited for the lock.
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if cur.fetchone():
+                    continue
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name))
+        newly_applied.append(version)
+
+    return newly_applied
+
+
+def apply_without_transaction(conn: connection, version, name, sql) -> bool:
+    """Applies a no-transaction migration under a session lock. Returns False if another runner applied it first."""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            try:
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if cur.fetchone():
+                    return False
+                for statement in split_statements(sql):
+                    cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name))
+                return True
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        conn.autocommit = autocommit
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dbname", nargs="?", default="time_circus")
+    parser.add_argument("--status", action="store_true",
+                        help="list the migrations and whether they are applied, without applying any")
+    args = parser.parse_args()
+
+    conn = get_connection(args.dbname)
+    try:
+        if args.status:
+            applied = applied_versions(conn)
+            for version, name, _ in find_migrations():
+                print(f"{version:04d} {name}: {'applied' if version in applied else 'pending'}")
+        else:
+            versions = apply_migrations(conn)
+            print(f"Applied {len(versions)} migration(s) to {args.dbname}.")
+    finally:
+        conn.close()
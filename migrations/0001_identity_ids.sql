@@ -0,0 +1,28 @@
+-- Databases created before the performance and assignment IDs became identity
+-- columns get them converted, with each sequence moved past the existing rows.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema()
+                   AND table_name = 'performance'
+                   AND column_name = 'performance_id'
+                   AND is_identity = 'YES') THEN
+        ALTER TABLE performance ALTER COLUMN performance_id ADD GENERATED BY DEFAULT AS IDENTITY;
+        PERFORM setval(pg_get_serial_sequence('performance', 'performance_id'),
+                       COALESCE((SELECT MAX(performance_id) FROM performance), 0) + 1, false);
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema()
+                   AND table_name = 'performance_performer_assignment'
+                   AND column_name = 'performance_performer_assignment_id'
+                   AND is_identity = 'YES') THEN
+        ALTER TABLE performance_performer_assignment
+            ALTER COLUMN performance_performer_assignment_id ADD GENERATED BY DEFAULT AS IDENTITY;
+        PERFORM setval(pg_get_serial_sequence('performance_performer_assignment',
+                                              'performance_performer_assignment_id'),
+                       COALESCE((SELECT MAX(performance_performer_assignment_id)
+                                 FROM performance_performer_assignment), 0) + 1, false);
+    END IF;
+END
+$$;
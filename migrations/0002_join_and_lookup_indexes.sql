@@ -0,0 +1,30 @@
+-- migrate: no-transaction
+-- Built CONCURRENTLY so writes carry on while the indexes build. A build that
+-- fails leaves an INVALID index that IF NOT EXISTS would skip over; drop it
+-- before running the migration again.
+
+-- Foreign keys do not get indexes of their own, so every join in api.py
+-- was scanning the referencing table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performance_performer_assignment_performance_id_idx
+    ON performance_performer_assignment (performance_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performance_performer_assignment_performer_id_idx
+    ON performance_performer_assignment (performer_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performer_specialty_id_idx
+    ON performer (specialty_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performance_venue_id_idx
+    ON performance (venue_id);
+
+-- POST /performances looks venues up by name, and names must be unique for
+-- that lookup to mean anything.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS venue_venue_name_key
+    ON venue (venue_name);
+
+-- Keyset pagination of /performers walks these in either direction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performer_birth_year_idx
+    ON performer ((EXTRACT(YEAR FROM performer_dob)), performer_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performer_stagename_idx
+    ON performer (performer_stagename, performer_id);
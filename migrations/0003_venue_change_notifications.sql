@@ -0,0 +1,18 @@
+-- Announce every change to venue on the venue_changed channel, so processes
+-- caching the venue table know to drop their copy.
+CREATE OR REPLACE FUNCTION notify_venue_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('venue_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS venue_changed ON venue;
+CREATE TRIGGER venue_changed
+    AFTER INSERT OR UPDATE OR DELETE ON venue
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_venue_changed();
+
+DROP TRIGGER IF EXISTS venue_truncated ON venue;
+CREATE TRIGGER venue_truncated
+    AFTER TRUNCATE ON venue
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_venue_changed();
@@ -0,0 +1,46 @@
+-- A change counter per table, bumped once by every statement that writes to
+-- it, so readers can tell whether anything changed without running their
+-- query. Each counter is split over 16 shards that writers pick by backend
+-- pid, so concurrent writers to one table rarely wait on the same row lock;
+-- a table's version is the sum of its shards.
+CREATE TABLE IF NOT EXISTS table_version (
+    table_name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, shard)
+);
+
+INSERT INTO table_version (table_name, shard)
+SELECT table_name, shard
+FROM unnest(ARRAY['specialty', 'performer', 'venue', 'performance',
+                  'performance_performer_assignment']) AS table_name,
+     generate_series(0, 15) AS shard
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_version SET version = version + 1
+    WHERE table_name = TG_TABLE_NAME AND shard = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    versioned_table TEXT;
+BEGIN
+    FOREACH versioned_table IN ARRAY ARRAY['specialty', 'performer', 'venue', 'performance',
+                                           'performance_performer_assignment'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I',
+                       versioned_table || '_version', versioned_table);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()',
+                       versioned_table || '_version', versioned_table);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I',
+                       versioned_table || '_truncate_version', versioned_table);
+        EXECUTE format('CREATE TRIGGER %I AFTER TRUNCATE ON %I
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()',
+                       versioned_table || '_truncate_version', versioned_table);
+    END LOOP;
+END
+$$;
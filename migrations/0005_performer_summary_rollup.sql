@@ -0,0 +1,119 @@
+-- Per-performer performance counts and review score totals for
+-- /performers/summary, kept current by triggers so the endpoint no longer
+-- aggregates the whole performance history on every request.
+-- scored_performances counts only performances with a review score, so that
+-- review_score_sum / scored_performances matches AVG(review_score).
+CREATE TABLE IF NOT EXISTS performer_summary (
+    performer_id BIGINT PRIMARY KEY REFERENCES performer(performer_id) ON DELETE CASCADE,
+    total_performances BIGINT NOT NULL DEFAULT 0,
+    scored_performances BIGINT NOT NULL DEFAULT 0,
+    review_score_sum BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS performer_summary_total_performances_idx
+    ON performer_summary (total_performances DESC, performer_id)
+    WHERE total_performances > 0;
+
+-- Moves assignments that were deleted (or updated away) out of the totals
+-- and assignments that were inserted (or updated in) into them.
+CREATE OR REPLACE FUNCTION performer_summary_assignments_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO performer_summary AS s
+            (performer_id, total_performances, scored_performances, review_score_sum)
+        SELECT a.performer_id, -COUNT(*), -COUNT(p.review_score), -COALESCE(SUM(p.review_score), 0)
+        FROM old_assignments AS a
+        JOIN performance AS p ON p.performance_id = a.performance_id
+        WHERE a.performer_id IS NOT NULL
+        GROUP BY a.performer_id
+        ORDER BY a.performer_id
+        ON CONFLICT (performer_id) DO UPDATE SET
+            total_performances = s.total_performances + EXCLUDED.total_performances,
+            scored_performances = s.scored_performances + EXCLUDED.scored_performances,
+            review_score_sum = s.review_score_sum + EXCLUDED.review_score_sum;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO performer_summary AS s
+            (performer_id, total_performances, scored_performances, review_score_sum)
+        SELECT a.performer_id, COUNT(*), COUNT(p.review_score), COALESCE(SUM(p.review_score), 0)
+        FROM new_assignments AS a
+        JOIN performance AS p ON p.performance_id = a.performance_id
+        WHERE a.performer_id IS NOT NULL
+        GROUP BY a.performer_id
+        ORDER BY a.performer_id
+        ON CONFLICT (performer_id) DO UPDATE SET
+            total_performances = s.total_performances + EXCLUDED.total_performances,
+            scored_performances = s.scored_performances + EXCLUDED.scored_performances,
+            review_score_sum = s.review_score_sum + EXCLUDED.review_score_sum;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION performer_summary_assignments_truncated() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM performer_summary;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Changing a review score moves the score totals of everyone who performed in it.
+CREATE OR REPLACE FUNCTION performer_summary_scores_updated() RETURNS trigger AS $$
+BEGIN
+    UPDATE performer_summary AS s SET
+        scored_performances = s.scored_performances + d.scored_change,
+        review_score_sum = s.review_score_sum + d.score_change
+    FROM (
+        SELECT a.performer_id,
+               SUM((n.review_score IS NOT NULL)::INT - (o.review_score IS NOT NULL)::INT) AS scored_change,
+               SUM(COALESCE(n.review_score, 0) - COALESCE(o.review_score, 0)) AS score_change
+        FROM old_performances AS o
+        JOIN new_performances AS n ON n.performance_id = o.performance_id
+        JOIN performance_performer_assignment AS a ON a.performance_id = n.performance_id
+        WHERE n.review_score IS DISTINCT FROM o.review_score
+        GROUP BY a.performer_id
+    ) AS d
+    WHERE s.performer_id = d.performer_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS performer_summary_insert ON performance_performer_assignment;
+CREATE TRIGGER performer_summary_insert
+    AFTER INSERT ON performance_performer_assignment
+    REFERENCING NEW TABLE AS new_assignments
+    FOR EACH STATEMENT EXECUTE FUNCTION performer_summary_assignments_changed();
+
+DROP TRIGGER IF EXISTS performer_summary_delete ON performance_performer_assignment;
+CREATE TRIGGER performer_summary_delete
+    AFTER DELETE ON performance_performer_assignment
+    REFERENCING OLD TABLE AS old_assignments
+    FOR EACH STATEMENT EXECUTE FUNCTION performer_summary_assignments_changed();
+
+DROP TRIGGER IF EXISTS performer_summary_update ON performance_performer_assignment;
+CREATE TRIGGER performer_summary_update
+    AFTER UPDATE ON performance_performer_assignment
+    REFERENCING OLD TABLE AS old_assignments NEW TABLE AS new_assignments
+    FOR EACH STATEMENT EXECUTE FUNCTION performer_summary_assignments_changed();
+
+DROP TRIGGER IF EXISTS performer_summary_truncate ON performance_performer_assignment;
+CREATE TRIGGER performer_summary_truncate
+    AFTER TRUNCATE ON performance_performer_assignment
+    FOR EACH STATEMENT EXECUTE FUNCTION performer_summary_assignments_truncated();
+
+DROP TRIGGER IF EXISTS performer_summary_scores ON performance;
+CREATE TRIGGER performer_summary_scores
+    AFTER UPDATE ON performance
+    REFERENCING OLD TABLE AS old_performances NEW TABLE AS new_performances
+    FOR EACH STATEMENT EXECUTE FUNCTION performer_summary_scores_updated();
+
+-- Backfill from the data already there.
+DELETE FROM performer_summary;
+INSERT INTO performer_summary (performer_id, total_performances, scored_performances, review_score_sum)
+SELECT a.performer_id, COUNT(*), COUNT(p.review_score), COALESCE(SUM(p.review_score), 0)
+FROM performance_performer_assignment AS a
+JOIN performance AS p ON p.performance_id = a.performance_id
+JOIN performer AS pe ON pe.performer_id = a.performer_id
+GROUP BY a.performer_id;
@@ -0,0 +1,14 @@
+-- migrate: no-transaction
+-- Built CONCURRENTLY so writes carry on while the indexes build. A build that
+-- fails leaves an INVALID index that IF NOT EXISTS would skip over; drop it
+-- before running the migration again.
+
+-- GET /performances filters by date range, venue, performer and review
+-- score. Venues and performers are covered by performance_venue_id_idx and
+-- performance_performer_assignment_performer_id_idx from 0002; these cover
+-- the rest, so a narrow filter reads only the performances it matches.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performance_performance_date_idx
+    ON performance (performance_date);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS performance_review_score_idx
+    ON performance (review_score);
@@ -0,0 +1,150 @@
+-- One row per performance holding everything GET /performances/<id> returns,
+-- kept current by triggers, so reading a performance is a primary key lookup
+-- instead of a four way join.
+-- A performance only has a row once it has a venue and a performer, the same
+-- performances the join returns.
+CREATE TABLE IF NOT EXISTS performance_detail (
+    performance_id BIGINT PRIMARY KEY REFERENCES performance(performance_id) ON DELETE CASCADE,
+    performer_names VARCHAR(50)[] NOT NULL,
+    venue_name VARCHAR(100),
+    performance_date DATE,
+    review_score SMALLINT
+);
+
+-- What performance_detail must always agree with. The triggers refresh rows
+-- from it and admin.py rebuilds and verifies the table against it.
+CREATE OR REPLACE VIEW live_performance_detail AS
+SELECT pe.performance_id,
+       array_agg(per.performer_stagename ORDER BY ppai.performance_performer_assignment_id) AS performer_names,
+       ve.venue_name,
+       pe.performance_date,
+       pe.review_score
+FROM performance AS pe
+JOIN venue AS ve ON ve.venue_id = pe.venue_id
+JOIN performance_performer_assignment AS ppai ON ppai.performance_id = pe.performance_id
+JOIN performer AS per ON per.performer_id = ppai.performer_id
+-- Grouping by every column, not just the key, keeps the view from depending
+-- on performance_pkey, which generate_data.py drops during a load.
+GROUP BY pe.performance_id, ve.venue_name, pe.performance_date, pe.review_score;
+
+-- Recomputes the rows of the given performances.
+CREATE OR REPLACE FUNCTION refresh_performance_detail(performance_ids BIGINT[]) RETURNS void AS $$
+BEGIN
+    -- Writers to the same performance take turns here, so each recomputes
+    -- from what the one before it committed. NO KEY UPDATE does not conflict
+    -- with the KEY SHARE locks the assignment foreign key takes.
+    PERFORM 1 FROM performance
+    WHERE performance_id = ANY(performance_ids)
+    ORDER BY performance_id
+    FOR NO KEY UPDATE;
+
+    DELETE FROM performance_detail WHERE performance_id = ANY(performance_ids);
+    INSERT INTO performance_detail (performance_id, performer_names, venue_name, performance_date, review_score)
+    SELECT performance_id, performer_names, venue_name, performance_date, review_score
+    FROM live_performance_detail
+    WHERE performance_id = ANY(performance_ids);
+END;
+$$ LANGUAGE plpgsql;
+
+-- A new performance has no performers yet, so it gets its row when its
+-- assignments are inserted, and a deleted one takes its row with it (ON
+-- DELETE CASCADE). Only updates to performances need a trigger.
+CREATE OR REPLACE FUNCTION performance_detail_performances_updated() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_performance_detail(ARRAY(SELECT performance_id FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION performance_detail_assignments_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_performance_detail(ARRAY(SELECT DISTINCT performance_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_performance_detail(ARRAY(SELECT DISTINCT performance_id FROM old_rows));
+    ELSE
+        PERFORM refresh_performance_detail(ARRAY(
+            SELECT performance_id FROM old_rows UNION SELECT performance_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Renaming a venue or performer changes every performance that shows the name.
+CREATE OR REPLACE FUNCTION performance_detail_venues_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_performance_detail(ARRAY(
+        SELECT pe.performance_id
+        FROM performance AS pe
+        JOIN old_rows AS o ON o.venue_id = pe.venue_id
+        JOIN new_rows AS n ON n.venue_id = o.venue_id
+        WHERE n.venue_name IS DISTINCT FROM o.venue_name));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION performance_detail_performers_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_performance_detail(ARRAY(
+        SELECT DISTINCT ppai.performance_id
+        FROM performance_performer_assignment AS ppai
+        JOIN old_rows AS o ON o.performer_id = ppai.performer_id
+        JOIN new_rows AS n ON n.performer_id = o.performer_id
+        WHERE n.performer_stagename IS DISTINCT FROM o.performer_stagename));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION performance_detail_assignments_truncated() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM performance_detail;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS performance_detail_update ON performance;
+CREATE TRIGGER performance_detail_update
+    AFTER UPDATE ON performance
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_performances_updated();
+
+DROP TRIGGER IF EXISTS performance_detail_assignments_insert ON performance_performer_assignment;
+CREATE TRIGGER performance_detail_assignments_insert
+    AFTER INSERT ON performance_performer_assignment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_assignments_changed();
+
+DROP TRIGGER IF EXISTS performance_detail_assignments_delete ON performance_performer_assignment;
+CREATE TRIGGER performance_detail_assignments_delete
+    AFTER DELETE ON performance_performer_assignment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_assignments_changed();
+
+DROP TRIGGER IF EXISTS performance_detail_assignments_update ON performance_performer_assignment;
+CREATE TRIGGER performance_detail_assignments_update
+    AFTER UPDATE ON performance_performer_assignment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_assignments_changed();
+
+DROP TRIGGER IF EXISTS performance_detail_assignments_truncate ON performance_performer_assignment;
+CREATE TRIGGER performance_detail_assignments_truncate
+    AFTER TRUNCATE ON performance_performer_assignment
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_assignments_truncated();
+
+DROP TRIGGER IF EXISTS performance_detail_venues ON venue;
+CREATE TRIGGER performance_detail_venues
+    AFTER UPDATE ON venue
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_venues_changed();
+
+DROP TRIGGER IF EXISTS performance_detail_performers ON performer;
+CREATE TRIGGER performance_detail_performers
+    AFTER UPDATE ON performer
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION performance_detail_performers_changed();
+
+-- Backfill from the data already there.
+DELETE FROM performance_detail;
+INSERT INTO performance_detail (performance_id, performer_names, venue_name, performance_date, review_score)
+SELECT performance_id, performer_names, venue_name, performance_date, review_score
+FROM live_performance_detail;
@@ -1,3 +1,16 @@
+-- The migrations in migrations/ build these on the tables below, so they go
+-- first. Dropping schema_migrations too means a database reset with this file
+-- is brought up to date again by python migrate.py.
+DROP VIEW IF EXISTS live_performance_detail;
+
+DROP TABLE IF EXISTS performance_detail;
+
+DROP TABLE IF EXISTS performer_summary;
+
+DROP TABLE IF EXISTS table_version;
+
+DROP TABLE IF EXISTS schema_migrations;
+
 DROP TABLE IF EXISTS performance_performer_assignment;
 
 DROP TABLE IF EXISTS performance;
@@ -27,7 +40,7 @@ CREATE TABLE venue (
 );
 
 CREATE TABLE performance (
-    performance_id BIGINT PRIMARY KEY,
+    performance_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
     venue_id BIGINT,
     performance_date DATE,
     review_score SMALLINT,
@@ -35,7 +48,7 @@ CREATE TABLE performance (
 );
 
 CREATE TABLE performance_performer_assignment (
-    performance_performer_assignment_id BIGINT PRIMARY KEY,
+    performance_performer_assignment_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
     performer_id BIGINT,
     performance_id BIGINT,
     FOREIGN KEY (performer_id) REFERENCES performer(performer_id),
@@ -300,4 +313,10 @@ INSERT INTO performance_performer_assignment (performance_performer_assignment_i
 (53, 48, 23),
 (54, 49, 24),
 (55, 50, 25)
-;
\ No newline at end of file
+;
+
+SELECT setval(pg_get_serial_sequence('performance', 'performance_id'),
+    (SELECT MAX(performance_id) FROM performance));
+
+SELECT setval(pg_get_serial_sequence('performance_performer_assignment', 'performance_performer_assignment_id'),
+    (SELECT MAX(performance_performer_assignment_id) FROM performance_performer_assignment));
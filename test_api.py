@@ -1,9 +1,30 @@
 # pylint: skip-file
-from unittest.mock import patch
+import gzip
+import json
+import time
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
 from datetime import date, datetime
+from decimal import Decimal
 
 import pytest
-from psycopg2 import connect
+from psycopg2 import connect, Error as DatabaseError, OperationalError
+from psycopg2.pool import PoolError
+
+import api
+from admin import (rebuild_performance_detail, rebuild_performer_summary, verify_performance_detail,
+                   verify_performer_summary)
+from api import app
+from bench_load import find_regressions, percentile
+from caching import VenueCache
+from compression import ENCODINGS, brotli, compress
+from metrics import RequestMetrics
+from serialization import ENCODERS, encode_value
+from database_functions import (ConnectionPool, PreparedStatements, ReplicaSet, allocate_ids, get_connection,
+                                explain)
+from generate_data import load as load_generated_data, LOADED_TABLES
+from migrate import apply_migrations, find_migrations
 
 
 class TestPerformerRoute_Task_1:
@@ -102,6 +123,97 @@ class TestPerformerRoute_Task_1:
         assert "message" in res.text
 
 
+class TestPerformerPagination:
+    """Tests for keyset pagination of the /performers route."""
+
+    def pages(self, test_api, args, limit):
+        """Follows the next links from the first page and returns every row seen."""
+        rows = []
+        res = test_api.get("/performers", query_string={**args, "limit": limit})
+        while True:
+            assert res.status_code == 200
+            assert len(res.json) <= limit
+            rows.extend(res.json)
+            if "Link" not in res.headers:
+                return rows
+            next_url = res.headers["Link"].split(">")[0].lstrip("<")
+            res = test_api.get(next_url)
+
+    @pytest.mark.parametrize("sort", (None, "birth_year", "specialty", "performer_name"))
+    @pytest.mark.parametrize("order", (None, "ascending", "descending"))
+    def test_pages_match_unpaginated_list(self, sort, order, test_api):
+        """Following the next links visits every performer once, in the unpaginated order."""
+        args = {k: v for k, v in (("sort", sort), ("order", order)) if v}
+        expected = test_api.get("/performers", query_string=args).json
+
+        assert self.pages(test_api, args, 7) == expected
+
+    @pytest.mark.parametrize("sort", (None, "specialty", "performer_name"))
+    @pytest.mark.parametrize("order", ("ascending", "descending"))
+    @pytest.mark.parametrize("limit", (2, 7))
+    def test_pages_include_null_sort_values(self, sort, order, limit, test_api, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performer SET performer_dob = NULL WHERE performer_id IN (1, 2, 3);")
+            cur.execute("UPDATE performer SET performer_stagename = NULL WHERE performer_id IN (4, 5, 6);")
+            cur.execute("UPDATE specialty SET specialty_name = NULL "
+                        "WHERE specialty_id = (SELECT specialty_id FROM performer WHERE performer_id = 7);")
+            test_temp_conn.commit()
+        args = {k: v for k, v in (("sort", sort), ("order", order)) if v}
+        expected = test_api.get("/performers", query_string=args).json
+
+        assert len(expected) == 50
+        assert self.pages(test_api, args, limit) == expected
+
+    def test_returns_first_page(self, test_api, example_performers):
+        res = test_api.get("/performers?limit=5")
+
+        assert res.json == example_performers[:5]
+        assert 'rel="next"' in res.headers["Link"]
+
+    def test_last_page_has_no_next_link(self, test_api):
+        res = test_api.get("/performers?limit=50")
+
+        assert len(res.json) == 50
+        assert "Link" not in res.headers
+
+    @pytest.mark.parametrize("limit", ("0", "-1", "ten", "1001", "\u00b9", "\u0661"))
+    def test_invalid_limit_returns_error(self, limit, test_api):
+        res = test_api.get(f"/performers?limit={limit}")
+        assert res.status_code == 400
+        assert "error" in res.text
+
+    def test_invalid_cursor_returns_error(self, test_api):
+        res = test_api.get("/performers?limit=5&after=not-a-cursor")
+        assert res.status_code == 400
+        assert "error" in res.text
+
+    @pytest.mark.parametrize("sort, position", (
+        (None, [None, None, "abc", 1]),
+        (None, [None, None, [1, 2], 1]),
+        (None, [None, None, 2 ** 70, 1]),
+        ("performer_name", ["performer_name", None, 5, 1]),
+        ("specialty", ["specialty", None, {"a": 1}, 1]),
+        (None, [None, None, 5000, 2 ** 70]),
+        (None, [None, None, 5000, True]),
+    ))
+    def test_tampered_cursor_returns_error(self, sort, position, test_api):
+        cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+        sort_query = f"&sort={sort}" if sort else ""
+
+        res = test_api.get(f"/performers?limit=5{sort_query}&after={cursor}")
+
+        assert res.status_code == 400
+        assert "Invalid after" in res.json["message"]
+
+    def test_cursor_is_tied_to_its_sort(self, test_api):
+        """A cursor issued for one sort cannot be replayed against another."""
+        res = test_api.get("/performers?limit=5")
+        cursor = res.headers["Link"].split("after=")[1].split(">")[0]
+
+        res = test_api.get(f"/performers?limit=5&sort=specialty&after={cursor}")
+        assert res.status_code == 400
+
+
 class TestVenueRoute_Task_1:
     """Tests for the Performers routes"""
 
@@ -417,6 +529,109 @@ class TestPerformancesPost_Task_3:
         assert "error" in res.text
 
 
+class TestPerformanceIdAllocation:
+    """Tests for sequence-backed ID allocation on the performance write paths."""
+
+    def test_post_continues_from_seeded_ids(self, test_api):
+        data = {"venue_name": "Grand Circus", "performer_id": [1, 2],
+                "performance_date": "2024-01-01", "review_score": 85}
+        res = test_api.post("/performances", json=data)
+
+        assert res.json["performance_id"] == 101
+
+    def test_concurrent_posts_get_distinct_ids(self):
+        """Parallel writers never compute the same performance ID."""
+        data = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 85}
+
+        def post(_):
+            return app.test_client().post("/performances", json=data)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(post, range(24)))
+
+        assert all(res.status_code == 200 for res in responses)
+        ids = [res.json["performance_id"] for res in responses]
+        assert sorted(ids) == list(range(101, 125))
+
+    def test_allocate_ids_reserves_unique_block(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            first = allocate_ids(cur, "performance", "performance_id", 5)
+            second = allocate_ids(cur, "performance", "performance_id", 3)
+
+        assert first == [101, 102, 103, 104, 105]
+        assert second == [106, 107, 108]
+
+
+class TestPerformancesBatchPost:
+    """Tests for the /performances/batch POST route."""
+
+    def test_creates_every_valid_performance(self, test_api, test_temp_conn):
+        data = [
+            {"venue_name": "Grand Circus", "performer_id": [1, 2],
+             "performance_date": "2024-01-01", "review_score": 85},
+            {"venue_name": "Mars Amphitheatre", "performer_id": [3],
+             "performance_date": "0095-08-07", "review_score": 70},
+        ]
+        res = test_api.post("/performances/batch", json=data)
+
+        assert res.status_code == 200
+        assert res.json["created"] == 2
+        ids = [r["performance_id"] for r in res.json["results"]]
+        assert ids == [101, 102]
+
+        res = test_api.get("/performances/101")
+        assert sorted(res.json["performer_names"]) == ["Julius the Juggler", "Orac the Oracle"]
+        assert res.json["venue_name"] == "Grand Circus"
+
+    def test_reports_per_item_errors(self, test_api):
+        """Bad items are reported by index without rejecting the good ones."""
+        data = [
+            {"venue_name": "Nonexistent Venue", "performer_id": [1],
+             "performance_date": "2024-01-01", "review_score": 85},
+            {"venue_name": "Grand Circus", "performer_id": [1],
+             "performance_date": "2024-01-01", "review_score": 85},
+            {"venue_name": "Grand Circus", "performer_id": [999],
+             "performance_date": "2024-01-01", "review_score": 85},
+            {"venue_name": "Grand Circus", "performance_date": "2024-01-01", "review_score": 85},
+            {"venue_name": "Grand Circus", "performer_id": [1],
+             "performance_date": "yesterday", "review_score": 85},
+        ]
+        res = test_api.post("/performances/batch", json=data)
+
+        assert res.status_code == 200
+        assert res.json["created"] == 1
+        results = res.json["results"]
+        assert [r["index"] for r in results] == [0, 1, 2, 3, 4]
+        assert "error" in results[0]
+        assert results[1]["performance_id"] == 101
+        assert all("error" in r for r in results[2:])
+
+    @pytest.mark.parametrize("bad_item", (
+        {"venue_name": ["Grand Circus"]},
+        {"venue_name": {"name": "Grand Circus"}},
+        {"review_score": 40000},
+        {"review_score": -40000},
+        {"performer_id": [2 ** 63]},
+    ))
+    def test_malformed_values_are_per_item_errors(self, bad_item, test_api):
+        good = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 85}
+
+        res = test_api.post("/performances/batch", json=[{**good, **bad_item}, good])
+
+        assert res.status_code == 200
+        assert res.json["created"] == 1
+        assert "error" in res.json["results"][0]
+        assert res.json["results"][1]["performance_id"] == 101
+
+    @pytest.mark.parametrize("data", ([], {}, "performances", [{}] * 10001))
+    def test_rejects_invalid_body(self, data, test_api):
+        res = test_api.post("/performances/batch", json=data)
+        assert res.status_code == 400
+        assert "error" in res.text
+
+
 class TestPerformersSummary_Task_4:
     """Tests for the Performers Summary route."""
 
@@ -466,3 +681,1397 @@ class TestPerformersSummary_Task_4:
 
         assert isinstance(data, list), "Response is not a list"
         assert len(data) == 0, "List is not empty"
+
+
+class TestConnectionPool:
+    """Tests for the pooled connection layer."""
+
+    def test_failed_statement_is_rolled_back_on_return(self):
+        """A failed statement must not leave an aborted transaction for the next user."""
+        pool = ConnectionPool(app.config["DATABASE_NAME"], min_size=1, max_size=1)
+        conn = pool.getconn()
+        with pytest.raises(DatabaseError):
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM no_such_table;")
+        pool.putconn(conn)
+
+        conn = pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS count FROM venue;")
+            assert cur.fetchone()["count"] == 20
+        pool.putconn(conn)
+        pool.closeall()
+
+    def test_closed_connections_are_replaced(self):
+        """A connection that died while checked out is swapped for a new one."""
+        pool = ConnectionPool(app.config["DATABASE_NAME"], min_size=1, max_size=1)
+        conn = pool.getconn()
+        conn.close()
+        pool.putconn(conn)
+
+        conn = pool.getconn()
+        assert not conn.closed
+        pool.putconn(conn)
+        pool.closeall()
+
+    def test_exhausted_pool_times_out(self):
+        """Checking out more than max_size connections waits and then errors."""
+        pool = ConnectionPool(app.config["DATABASE_NAME"], min_size=0, max_size=1, timeout=0.1)
+        conn = pool.getconn()
+        with pytest.raises(PoolError):
+            pool.getconn()
+        pool.putconn(conn)
+        pool.closeall()
+
+    @pytest.mark.parametrize("password", ("a b", "it's", "back\\slash"))
+    def test_password_is_passed_apart_from_the_dsn(self, password):
+        with patch("database_functions.connect") as connect_mock:
+            get_connection("db", password=password, dsn="host=localhost port=5432")
+
+        assert connect_mock.call_args.args == ("host=localhost port=5432",)
+        assert connect_mock.call_args.kwargs["password"] == password
+
+    def test_password_in_the_dsn_wins(self):
+        with patch("database_functions.connect") as connect_mock:
+            get_connection("db", password="unused", dsn="host=localhost password=secret")
+
+        assert "password" not in connect_mock.call_args.kwargs
+
+    def test_requests_use_the_configured_database(self, test_api, test_temp_conn):
+        """The API reads from whichever database the pool is pointed at."""
+        with test_temp_conn.cursor() as cur:
+            cur.execute("INSERT INTO venue (venue_id, venue_name) VALUES (21, 'Pool Hall');")
+            test_temp_conn.commit()
+
+        assert len(test_api.get("/venues").json) == 21
+
+
+class TestStreamedResponses:
+    """Tests for the opt-in streamed responses of the list endpoints."""
+
+    @pytest.mark.parametrize("route", ("/performers", "/performers?sort=specialty&order=ascending",
+                                       "/venues", "/performances", "/performers/summary"))
+    def test_streamed_response_matches_regular_response(self, route, test_api, monkeypatch):
+        """Streaming in small batches returns the same list as the regular response."""
+        monkeypatch.setitem(test_api.application.config, "STREAM_BATCH_SIZE", 7)
+        expected = test_api.get(route).json
+
+        separator = "&" if "?" in route else "?"
+        res = test_api.get(f"{route}{separator}stream=true")
+
+        assert res.status_code == 200
+        assert res.is_streamed
+        assert res.json == expected
+
+    def test_streams_empty_list(self, test_api, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE performance CASCADE;")
+            test_temp_conn.commit()
+
+        res = test_api.get("/performances?stream=true")
+        assert res.json == []
+
+    @pytest.mark.parametrize("route", ("/performers", "/venues", "/performances", "/performers/summary"))
+    def test_invalid_stream_parameter_returns_error(self, route, test_api):
+        res = test_api.get(f"{route}?stream=yes")
+        assert res.status_code == 400
+        assert "error" in res.text
+
+    def test_stream_cannot_be_paginated(self, test_api):
+        res = test_api.get("/performers?stream=true&limit=5")
+        assert res.status_code == 400
+
+
+class TestMigrations:
+    """Tests for the schema migration runner."""
+
+    def test_records_every_migration(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT version FROM schema_migrations ORDER BY version;")
+            versions = [row["version"] for row in cur.fetchall()]
+
+        assert versions == [version for version, _, _ in find_migrations()]
+
+    def test_rerunning_applies_nothing(self, test_temp_conn):
+        assert apply_migrations(test_temp_conn) == []
+
+    def test_creates_join_and_lookup_indexes(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public';")
+            indexes = {row["indexname"] for row in cur.fetchall()}
+
+        assert {"performance_performer_assignment_performance_id_idx",
+                "performance_performer_assignment_performer_id_idx",
+                "performer_specialty_id_idx",
+                "performance_venue_id_idx",
+                "venue_venue_name_key"} <= indexes
+
+    def test_concurrent_index_builds_leave_valid_indexes(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("DROP INDEX performance_performance_date_idx, performance_review_score_idx;")
+            cur.execute("DELETE FROM schema_migrations WHERE version = 6;")
+            test_temp_conn.commit()
+
+        assert apply_migrations(test_temp_conn) == [6]
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("""
+                SELECT indexrelid::regclass::text AS name, indisvalid FROM pg_index
+                WHERE indexrelid::regclass::text IN ('performance_performance_date_idx', 'performance_review_score_idx');
+                """)
+            assert {row["name"]: row["indisvalid"] for row in cur.fetchall()} == {
+                "performance_performance_date_idx": True, "performance_review_score_idx": True}
+
+    def test_no_transaction_migrations_run_outside_a_transaction(self, test_temp_conn, tmp_path):
+        (tmp_path / "0001_concurrent_index.sql").write_text(
+            "-- migrate: no-transaction\n"
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS venue_lower_name_idx ON venue (lower(venue_name));\n"
+            "-- Statements run one at a time, comments and all.\n"
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS venue_id_name_idx ON venue (venue_id, venue_name);\n")
+        with test_temp_conn.cursor() as cur:
+            cur.execute("DELETE FROM schema_migrations;")
+            test_temp_conn.commit()
+
+        assert apply_migrations(test_temp_conn, str(tmp_path)) == [1]
+        assert apply_migrations(test_temp_conn, str(tmp_path)) == []
+        assert not test_temp_conn.autocommit
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'venue';")
+            assert {"venue_lower_name_idx", "venue_id_name_idx"} <= {row["indexname"] for row in cur.fetchall()}
+
+    def test_converts_plain_id_columns_to_identity(self, test_api, test_temp_conn):
+        """Databases created before IDs came from sequences are brought up to date."""
+        with test_temp_conn.cursor() as cur:
+            cur.execute("ALTER TABLE performance ALTER COLUMN performance_id DROP IDENTITY;")
+            cur.execute("DELETE FROM schema_migrations WHERE version = 1;")
+            test_temp_conn.commit()
+
+        assert apply_migrations(test_temp_conn) == [1]
+
+        data = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 85}
+        assert test_api.post("/performances", json=data).json["performance_id"] == 101
+
+
+    def test_setup_script_resets_a_migrated_database(self, test_api, test_temp_conn):
+        with open("setup-db.sql", "r") as f:
+            setup_sql = f.read()
+        with test_temp_conn.cursor() as cur:
+            cur.execute(setup_sql)
+            test_temp_conn.commit()
+
+        assert apply_migrations(test_temp_conn) == [version for version, _, _ in find_migrations()]
+        assert verify_performance_detail(test_temp_conn) == []
+        assert test_api.get("/performances/1").status_code == 200
+
+
+class TestVenueCache:
+    """Tests for the in-process venue name lookup cache."""
+
+    def test_cached_lookups_skip_the_database(self, test_temp_conn):
+        cache = VenueCache(app.config["DATABASE_NAME"])
+        assert cache.lookup(test_temp_conn, ["Grand Circus"]) == {"Grand Circus": 1}
+
+        untouched_conn = MagicMock()
+        assert cache.lookup(untouched_conn, ["Grand Circus", "Time Travel Hub"]) == {
+            "Grand Circus": 1, "Time Travel Hub": 20}
+        assert not untouched_conn.cursor.called
+        cache.close()
+
+    def test_unknown_venues_are_not_found(self, test_temp_conn):
+        cache = VenueCache(app.config["DATABASE_NAME"])
+        assert cache.lookup(test_temp_conn, ["Nonexistent Venue"]) == {}
+        cache.close()
+
+    def test_respects_max_size(self, test_temp_conn):
+        cache = VenueCache(app.config["DATABASE_NAME"], max_size=5)
+        assert cache.lookup(test_temp_conn, ["Time Travel Hub"]) == {"Time Travel Hub": 20}
+        assert cache.lookup(test_temp_conn, ["Mountain Top"]) == {"Mountain Top": 14}
+        assert len(cache._venues) == 5
+        cache.close()
+
+    def test_venue_changes_invalidate_the_cache(self, test_temp_conn):
+        cache = VenueCache(app.config["DATABASE_NAME"])
+        assert cache.lookup(test_temp_conn, ["Grand Circus"]) == {"Grand Circus": 1}
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE venue SET venue_name = 'Grander Circus' WHERE venue_id = 1;")
+            test_temp_conn.commit()
+
+        # Notifications arrive asynchronously, give this one a moment to land.
+        for _ in range(50):
+            if cache.lookup(test_temp_conn, ["Grand Circus"]) == {}:
+                break
+            time.sleep(0.02)
+
+        assert cache.lookup(test_temp_conn, ["Grand Circus"]) == {}
+        assert cache.lookup(test_temp_conn, ["Grander Circus"]) == {"Grander Circus": 1}
+        cache.close()
+
+
+class TestResponseCache:
+    """Tests for the GET response cache."""
+
+    def test_repeated_request_is_served_from_cache(self, test_api, test_temp_conn):
+        assert test_api.get("/venues").headers["X-Cache"] == "MISS"
+
+        # Changes made behind the API's back are not seen until the entry expires.
+        with test_temp_conn.cursor() as cur:
+            cur.execute("INSERT INTO venue (venue_id, venue_name) VALUES (21, 'Pool Hall');")
+            test_temp_conn.commit()
+
+        res = test_api.get("/venues")
+        assert res.headers["X-Cache"] == "HIT"
+        assert len(res.json) == 20
+
+    def test_query_string_order_does_not_matter(self, test_api):
+        first = test_api.get("/performers?sort=specialty&order=ascending")
+        second = test_api.get("/performers?order=ascending&sort=specialty")
+
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.json == first.json
+
+    def test_post_invalidates_only_affected_routes(self, test_api):
+        test_api.get("/venues")
+        before = test_api.get("/performers/summary").json
+
+        data = {"venue_name": "Grand Circus", "performer_id": [22],
+                "performance_date": "2024-01-01", "review_score": 85}
+        test_api.post("/performances", json=data)
+
+        assert test_api.get("/venues").headers["X-Cache"] == "HIT"
+        res = test_api.get("/performers/summary")
+        assert res.headers["X-Cache"] == "MISS"
+        assert res.json != before
+
+    def test_write_during_a_miss_keeps_the_stale_body_out(self, test_api, test_temp_conn, monkeypatch):
+        make_response = app.make_response
+
+        def write_then_make_response(rv):
+            # The view has read its rows; a write commits before they are stored.
+            monkeypatch.setattr(app, "make_response", make_response)
+            with test_temp_conn.cursor() as cur:
+                cur.execute("INSERT INTO performance_performer_assignment (performance_id, performer_id) "
+                            "VALUES (2, 1);")
+                test_temp_conn.commit()
+            api.invalidate_cached_responses('performance', 'performance_performer_assignment')
+            return make_response(rv)
+
+        monkeypatch.setattr(app, "make_response", write_then_make_response)
+        stale = test_api.get("/performers/summary").json
+
+        res = test_api.get("/performers/summary")
+        assert res.headers["X-Cache"] == "MISS"
+        assert res.json != stale
+
+    def test_entries_expire(self, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_TTL", 0)
+        test_api.get("/venues")
+        assert test_api.get("/venues").headers["X-Cache"] == "MISS"
+
+    def test_least_recently_used_entry_is_evicted(self, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_SIZE", 2)
+        test_api.get("/venues")
+        test_api.get("/performers")
+        test_api.get("/venues")
+        test_api.get("/performer_specialty")
+
+        assert test_api.get("/venues").headers["X-Cache"] == "HIT"
+        assert test_api.get("/performers").headers["X-Cache"] == "MISS"
+
+    def test_streamed_and_failed_responses_are_not_cached(self, test_api):
+        test_api.get("/venues?stream=true").close()
+        test_api.get("/performers?sort=bread")
+
+        assert test_api.get("/performers?sort=bread").status_code == 400
+        assert test_api.get("/cache/stats").json["entries"] == 0
+
+    def test_exposes_hit_and_miss_counters(self, test_api):
+        test_api.get("/venues")
+        test_api.get("/venues")
+        test_api.get("/venues")
+
+        stats = test_api.get("/cache/stats").json
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+
+class TestConditionalGet:
+    """Tests for ETag / If-None-Match support on the list endpoints."""
+
+    @pytest.mark.parametrize("route", ("/performers", "/venues", "/performances", "/performances/1",
+                                       "/performer_specialty", "/performers/summary"))
+    def test_unchanged_data_returns_304(self, route, test_api):
+        etag = test_api.get(route).headers["ETag"]
+
+        res = test_api.get(route, headers={"If-None-Match": etag})
+        assert res.status_code == 304
+        assert res.data == b""
+        assert res.headers["ETag"] == etag
+
+    def test_304_skips_the_main_query(self, test_api, monkeypatch):
+        etag = test_api.get("/performances").headers["ETag"]
+
+        connections_used = []
+        original_get_db = api.get_db
+
+        def recording_get_db():
+            conn = original_get_db()
+            connections_used.append(conn)
+            return conn
+
+        monkeypatch.setattr(api, "get_db", recording_get_db)
+        res = test_api.get("/performances", headers={"If-None-Match": etag})
+
+        assert res.status_code == 304
+        # Only the one lookup of the table versions went to the database.
+        assert len(connections_used) == 1
+
+    def test_etag_changes_with_the_data(self, test_api, test_temp_conn):
+        etag = test_api.get("/performances").headers["ETag"]
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performance SET review_score = 50 WHERE performance_id = 1;")
+            test_temp_conn.commit()
+
+        res = test_api.get("/performances", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.headers["ETag"] != etag
+
+    def test_etag_differs_per_query_string(self, test_api):
+        ascending = test_api.get("/performers?order=ascending").headers["ETag"]
+        descending = test_api.get("/performers?order=descending").headers["ETag"]
+        assert ascending != descending
+
+    def test_conditional_request_revalidates_cached_response(self, test_api, test_temp_conn):
+        """A stale cached body is not served to a client whose ETag shows a change is possible."""
+        etag = test_api.get("/venues").headers["ETag"]
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("INSERT INTO venue (venue_id, venue_name) VALUES (21, 'Pool Hall');")
+            test_temp_conn.commit()
+
+        res = test_api.get("/venues", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.headers["X-Cache"] == "MISS"
+        assert len(res.json) == 21
+
+    def test_post_changes_etag(self, test_api):
+        etag = test_api.get("/performers/summary").headers["ETag"]
+        data = {"venue_name": "Grand Circus", "performer_id": [22],
+                "performance_date": "2024-01-01", "review_score": 85}
+        test_api.post("/performances", json=data)
+
+        res = test_api.get("/performers/summary", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+
+
+class TestPerformerSummaryRollup:
+    """Tests for the trigger-maintained rollup behind /performers/summary."""
+
+    def test_matches_live_aggregate(self, test_api, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("""
+                SELECT p.performer_id, p.performer_stagename,
+                COUNT(ppa.performance_id) AS total_performances,
+                ROUND(AVG(perf.review_score), 2) AS average_review_score
+                FROM performer p
+                JOIN performance_performer_assignment ppa ON p.performer_id = ppa.performer_id
+                JOIN performance perf ON ppa.performance_id = perf.performance_id
+                GROUP BY p.performer_id, p.performer_stagename
+                ORDER BY total_performances DESC, p.performer_id ASC;
+                """)
+            expected = [{**row, "average_review_score": str(row["average_review_score"])}
+                        for row in cur.fetchall()]
+
+        assert test_api.get("/performers/summary").json == expected
+
+    def test_stays_current_through_writes(self, test_api, test_temp_conn):
+        single = {"venue_name": "Grand Circus", "performer_id": [22, 21],
+                  "performance_date": "2024-01-01", "review_score": 40}
+        test_api.post("/performances", json=single)
+        test_api.post("/performances/batch", json=[single, {**single, "performer_id": [1]}])
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performance SET review_score = NULL WHERE performance_id = 1;")
+            cur.execute("UPDATE performance SET review_score = 10 WHERE performance_id = 2;")
+            cur.execute("UPDATE performance_performer_assignment SET performer_id = 3 "
+                        "WHERE performance_performer_assignment_id = 3;")
+            cur.execute("DELETE FROM performance_performer_assignment WHERE performance_id = 4;")
+            test_temp_conn.commit()
+
+        assert verify_performer_summary(test_temp_conn) == []
+
+    def test_truncating_assignments_empties_summary(self, test_api, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE performance CASCADE;")
+            test_temp_conn.commit()
+
+        assert verify_performer_summary(test_temp_conn) == []
+        assert test_api.get("/performers/summary").json == []
+
+    def test_rebuild_repairs_drift(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performer_summary SET total_performances = 99 WHERE performer_id = 1;")
+            cur.execute("DELETE FROM performer_summary WHERE performer_id = 2;")
+            test_temp_conn.commit()
+
+        assert [row["performer_id"] for row in verify_performer_summary(test_temp_conn)] == [1, 2]
+
+        rebuild_performer_summary(test_temp_conn)
+        assert verify_performer_summary(test_temp_conn) == []
+
+
+class TestPerformanceDetail:
+    """Tests for the trigger-maintained read model behind /performances/<id>."""
+
+    def test_stays_current_through_writes(self, test_api, test_temp_conn):
+        single = {"venue_name": "Grand Circus", "performer_id": [22, 21],
+                  "performance_date": "2024-01-01", "review_score": 40}
+        created = test_api.post("/performances", json=single).json["performance_id"]
+        test_api.post("/performances/batch", json=[single, {**single, "performer_id": [1]}])
+
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performance SET review_score = NULL, performance_date = '1999-12-31' "
+                        "WHERE performance_id = 1;")
+            cur.execute("UPDATE performance_performer_assignment SET performer_id = 3 "
+                        "WHERE performance_performer_assignment_id = 3;")
+            cur.execute("DELETE FROM performance_performer_assignment WHERE performance_id = 4;")
+            cur.execute("UPDATE venue SET venue_name = 'Grander Circus' WHERE venue_name = 'Grand Circus';")
+            cur.execute("UPDATE performer SET performer_stagename = 'Renamed' WHERE performer_id = 21;")
+            test_temp_conn.commit()
+
+        assert verify_performance_detail(test_temp_conn) == []
+        assert test_api.get(f"/performances/{created}").json["performer_names"][1] == "Renamed"
+        assert test_api.get("/performances/4").status_code == 404
+
+    def test_truncating_assignments_empties_detail(self, test_api, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE performance_performer_assignment CASCADE;")
+            test_temp_conn.commit()
+
+        assert verify_performance_detail(test_temp_conn) == []
+        assert test_api.get("/performances/1").status_code == 404
+
+    def test_concurrent_assignments_are_both_kept(self, test_temp_conn):
+        """A writer waiting on another recomputes the row from what that one committed."""
+        other_conn = get_connection(app.config["DATABASE_NAME"])
+        try:
+            with test_temp_conn.cursor() as cur:
+                cur.execute("INSERT INTO performance_performer_assignment (performer_id, performance_id) "
+                            "VALUES (5, 1);")
+
+            def add_other_performer():
+                with other_conn.cursor() as other_cur:
+                    other_cur.execute("INSERT INTO performance_performer_assignment (performer_id, performance_id) "
+                                      "VALUES (6, 1);")
+                other_conn.commit()
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                waiting = executor.submit(add_other_performer)
+                time.sleep(0.2)
+                test_temp_conn.commit()
+                waiting.result(timeout=10)
+        finally:
+            other_conn.close()
+
+        assert verify_performance_detail(test_temp_conn) == []
+
+    def test_rebuild_repairs_drift(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("UPDATE performance_detail SET performer_names = '{}' WHERE performance_id = 1;")
+            cur.execute("DELETE FROM performance_detail WHERE performance_id = 2;")
+            test_temp_conn.commit()
+
+        assert [row["performance_id"] for row in verify_performance_detail(test_temp_conn)] == [1, 2]
+
+        rebuild_performance_detail(test_temp_conn)
+        assert verify_performance_detail(test_temp_conn) == []
+
+    def test_rebuild_changes_the_etag(self, test_api, test_temp_conn):
+        etag = test_api.get("/performances/1").headers["ETag"]
+
+        rebuild_performance_detail(test_temp_conn)
+        res = test_api.get("/performances/1", headers={"If-None-Match": etag})
+
+        assert res.status_code == 200
+        assert res.headers["ETag"] != etag
+
+    def test_lookup_is_one_row(self, test_api, caplog, monkeypatch):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_THRESHOLD", 0)
+        caplog.set_level("WARNING", logger="database_functions.slow_queries")
+
+        res = test_api.get("/performances/12")
+
+        message = next(record.getMessage() for record in caplog.records
+                       if "EXECUTE performance_by_id" in record.getMessage())
+        assert "1 rows" in message
+        assert len(res.json["performer_names"]) == 2
+
+
+class TestDatabaseJsonMode:
+    """Tests for the mode where Postgres renders the JSON responses."""
+
+    @pytest.mark.parametrize("route", ("/performers", "/performers?sort=performer_name&order=ascending",
+                                       "/performers?sort=specialty&order=descending",
+                                       "/venues", "/performances", "/performances/1", "/performances/12",
+                                       "/performer_specialty", "/performers/summary"))
+    def test_matches_flask_rendered_response(self, route, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_SIZE", 0)
+        expected = test_api.get(route).json
+
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        res = test_api.get(route)
+
+        assert res.status_code == 200
+        assert res.mimetype == "application/json"
+        assert res.json == expected
+
+    def test_missing_performance_returns_404(self, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        res = test_api.get("/performances/999")
+
+        assert res.status_code == 404
+        assert "error" in res.text
+
+    @pytest.mark.parametrize("render_json_in_database", (False, True))
+    def test_id_too_large_for_bigint_returns_404(self, render_json_in_database, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", render_json_in_database)
+        res = test_api.get("/performances/99999999999999999999")
+
+        assert res.status_code == 404
+        assert "error" in res.text
+
+    def test_empty_list_is_rendered(self, test_api, test_temp_conn, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        with test_temp_conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE performance CASCADE;")
+            test_temp_conn.commit()
+
+        assert test_api.get("/performances").json == []
+
+
+class TestPreparedStatements:
+    """Tests for the registry that runs queries as server-side prepared statements."""
+
+    @staticmethod
+    def prepared_names(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT name FROM pg_prepared_statements ORDER BY name;")
+            return [row["name"] for row in cur.fetchall()]
+
+    def test_statement_is_prepared_once_per_connection(self, test_temp_conn):
+        registry = PreparedStatements()
+        registry.register("venue_by_id", "SELECT venue_name FROM venue WHERE venue_id = %s")
+
+        with test_temp_conn.cursor() as cur:
+            registry.execute(cur, "venue_by_id", (1,))
+            first = cur.fetchone()
+            with patch.object(cur, "execute", wraps=cur.execute) as execute:
+                registry.execute(cur, "venue_by_id", (2,))
+                second = cur.fetchone()
+
+        assert first["venue_name"] != second["venue_name"]
+        assert [call.args[0] for call in execute.call_args_list] == ["EXECUTE venue_by_id (%s)"]
+        assert self.prepared_names(test_temp_conn) == ["venue_by_id"]
+
+    def test_new_connection_prepares_again(self, test_db_conn):
+        registry = PreparedStatements()
+        registry.register("venue_count", "SELECT COUNT(*) AS count FROM venue")
+
+        for _ in range(2):
+            conn = connect(dbname=app.config["DATABASE_NAME"], host="localhost", port=5432, password="postgres",
+                           cursor_factory=api.RealDictCursor)
+            try:
+                with conn.cursor() as cur:
+                    registry.execute(cur, "venue_count")
+                    assert cur.fetchone()["count"] == 20
+                assert self.prepared_names(conn) == ["venue_count"]
+            finally:
+                conn.close()
+
+    def test_named_placeholders_and_literal_percent(self, test_temp_conn):
+        registry = PreparedStatements()
+        registry.register("venues_like", """
+            SELECT venue_id FROM venue
+            WHERE venue_name LIKE %(prefix)s || '%%' AND venue_id <= %(max_id)s AND venue_id >= %(prefix_len)s
+            """)
+
+        with test_temp_conn.cursor() as cur:
+            registry.execute(cur, "venues_like", {"max_id": 20, "prefix": "", "prefix_len": 0})
+            assert len(cur.fetchall()) == 20
+
+    def test_registering_different_sql_under_a_name_fails(self):
+        registry = PreparedStatements()
+        registry.register("venues", "SELECT * FROM venue")
+        registry.register("venues", "SELECT * FROM venue")
+
+        with pytest.raises(ValueError):
+            registry.register("venues", "SELECT * FROM venue ORDER BY venue_id")
+        with pytest.raises(ValueError):
+            registry.register("venues; DROP TABLE venue", "SELECT 1")
+
+    def test_routes_reuse_their_statements(self, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_SIZE", 0)
+        monkeypatch.setitem(test_api.application.config, "DB_POOL_MAX_SIZE", 1)
+        expected = test_api.get("/performers?sort=performer_name").json
+
+        assert test_api.get("/performers?sort=performer_name").json == expected
+
+        conn = api.get_pool().getconn()
+        try:
+            names = self.prepared_names(conn)
+        finally:
+            api.get_pool().putconn(conn)
+        assert len([name for name in names if name.startswith("performers_by_performer_name")]) == 1
+
+
+class TestJSONProvider:
+    """Tests for the JSON provider responses are encoded with."""
+
+    @pytest.mark.parametrize("encoder", sorted(ENCODERS))
+    @pytest.mark.parametrize("route", ("/performances", "/performances/1", "/performers/summary"))
+    def test_encoders_give_the_same_response(self, encoder, route, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_SIZE", 0)
+        expected = test_api.get(route).json
+
+        monkeypatch.setattr(test_api.application.json, "encoder", encoder)
+        res = test_api.get(route)
+
+        assert res.status_code == 200
+        assert res.json == expected
+
+    @pytest.mark.parametrize("encoder", sorted(ENCODERS))
+    def test_database_types_are_encoded(self, encoder):
+        row = {"performance_date": date(2024, 2, 29), "average": Decimal("4.50"),
+               "created": datetime(2024, 2, 29, 12, 30)}
+
+        assert ENCODERS[encoder](row) == \
+            b'{"performance_date":"2024-02-29","average":"4.50","created":"2024-02-29T12:30:00"}'
+
+    def test_performance_dates_are_not_reformatted(self, test_api):
+        assert test_api.get("/performances/1").json["performance_date"] == "2024-01-01"
+
+    def test_unknown_types_are_rejected(self):
+        with pytest.raises(TypeError):
+            encode_value(object())
+
+
+class TestQueryCount:
+    """Tests for counting the statements each request runs."""
+
+    def test_connection_counts_statements(self):
+        conn = get_connection(app.config["DATABASE_NAME"])
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.executemany("SELECT %s", [(1,), (2,)])
+            with conn.cursor(name="counted") as cur:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            assert conn.query_count == 3
+        finally:
+            conn.close()
+
+    def test_header_reports_statements_per_request(self, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "QUERY_COUNT_HEADER", True)
+
+        miss = test_api.get("/venues")
+        hit = test_api.get("/venues", headers={"If-None-Match": miss.headers["ETag"]})
+
+        # The table versions and the venues are each prepared then executed on
+        # the fresh connection, after which a 304 only executes the versions.
+        assert miss.headers["X-Query-Count"] == "4"
+        assert hit.headers["X-Query-Count"] == "1"
+
+    def test_header_is_off_by_default(self, test_api):
+        assert "X-Query-Count" not in test_api.get("/venues").headers
+
+
+class TestGeneratedData:
+    """Tests for the synthetic dataset generator and its COPY loader."""
+
+    @staticmethod
+    def load(conn, scale, seed=0):
+        with conn, conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(LOADED_TABLES)} CASCADE;")
+        return load_generated_data(conn, scale, seed)
+
+    def test_tables_grow_with_scale(self, test_temp_conn):
+        counts = self.load(test_temp_conn, 3)
+
+        assert counts["performer"] == 150
+        assert counts["venue"] == 60
+        assert counts["performance"] == 300
+        assert 300 < counts["performance_performer_assignment"] <= 1500
+
+    def test_same_seed_gives_same_data(self, test_temp_conn):
+        def snapshot():
+            with test_temp_conn.cursor() as cur:
+                cur.execute("SELECT * FROM performance_performer_assignment ORDER BY 1;")
+                return cur.fetchall()
+
+        self.load(test_temp_conn, 2, seed=7)
+        first = snapshot()
+        self.load(test_temp_conn, 2, seed=7)
+
+        assert snapshot() == first
+
+    def test_constraints_triggers_and_rollup_are_restored(self, test_temp_conn):
+        self.load(test_temp_conn, 2)
+
+        assert verify_performer_summary(test_temp_conn) == []
+        assert verify_performance_detail(test_temp_conn) == []
+        with test_temp_conn.cursor() as cur:
+            cur.execute("""SELECT COUNT(*) AS count FROM pg_trigger
+                           WHERE NOT tgisinternal AND tgenabled = 'D';""")
+            assert cur.fetchone()["count"] == 0
+            with pytest.raises(DatabaseError):
+                cur.execute("INSERT INTO performance_performer_assignment (performer_id, performance_id) "
+                            "VALUES (999999, 1);")
+        test_temp_conn.rollback()
+
+    def test_api_serves_generated_data(self, test_api, test_temp_conn):
+        self.load(test_temp_conn, 2)
+
+        res = test_api.post("/performances", json={"performer_id": [1, 2], "performance_date": "3000-01-01",
+                                                   "venue_name": test_api.get("/venues").json[0]["venue_name"],
+                                                   "review_score": 90})
+
+        assert res.status_code == 200
+        assert res.json["performance_id"] == 201
+        assert len(test_api.get("/performers").json) == 100
+
+
+class TestRequestMetrics:
+    """Tests for the per-request instrumentation behind /metrics and Server-Timing."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_metrics(self, monkeypatch):
+        monkeypatch.setattr(api, "request_metrics", RequestMetrics())
+        monkeypatch.setitem(app.config, "RESPONSE_CACHE_SIZE", 0)
+
+    def test_server_timing_breaks_out_database_and_serialization(self, test_api):
+        res = test_api.get("/performances")
+
+        timings = dict(part.split(";dur=") for part in res.headers["Server-Timing"].split(", "))
+        assert set(timings) == {"db", "serialize", "total"}
+        assert 0 < float(timings["db"]) <= float(timings["total"])
+        assert 0 < float(timings["serialize"]) <= float(timings["total"])
+
+    def test_metrics_are_recorded_per_route(self, test_api):
+        test_api.get("/performances/1")
+        test_api.get("/performances/2")
+        test_api.get("/performances/999")
+        body = test_api.get("/metrics").text
+
+        route = 'route="/performances/<int:performance_id>",method="GET"'
+        assert f'http_requests_total{{{route},status="200"}} 2' in body
+        assert f'http_requests_total{{{route},status="404"}} 1' in body
+        assert f'http_request_duration_seconds_bucket{{{route},le="+Inf"}} 3' in body
+        assert f'http_request_duration_seconds_count{{{route}}} 3' in body
+        # Each lookup runs the table versions and the performance; the first also prepares both.
+        assert f"http_request_queries_total{{{route}}} 8" in body
+        # Performances 1 and 2 have one performer each; the versions of four tables come with every lookup.
+        assert f"http_request_rows_fetched_total{{{route}}} 14" in body
+
+    def test_metrics_endpoint_is_prometheus_text(self, test_api):
+        res = test_api.get("/metrics")
+
+        assert res.status_code == 200
+        assert res.mimetype == "text/plain"
+        assert "# TYPE http_request_duration_seconds histogram" in res.text
+
+    def test_can_be_turned_off(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "METRICS_ENABLED", False)
+        res = test_api.get("/venues")
+
+        assert "Server-Timing" not in res.headers
+        assert "http_requests_total{" not in test_api.get("/metrics").text
+
+
+class TestSlowQueryLog:
+    """Tests for logging slow statements and capturing their plans."""
+
+    @pytest.fixture(autouse=True)
+    def log_every_statement(self, monkeypatch, caplog):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_THRESHOLD", 0)
+        monkeypatch.setitem(app.config, "RESPONSE_CACHE_SIZE", 0)
+        caplog.set_level("WARNING", logger="database_functions.slow_queries")
+
+    def test_logs_sql_params_route_and_rows(self, test_api, caplog):
+        test_api.get("/performances/12")
+
+        message = next(record.getMessage() for record in caplog.records
+                       if "EXECUTE performance_by_id" in record.getMessage())
+        assert "during GET /performances/12" in message
+        assert "1 rows" in message
+        assert "params: [12]" in message
+        assert "Seq Scan" not in message and "Index" not in message
+
+    def test_fast_statements_are_not_logged(self, test_api, caplog, monkeypatch):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_THRESHOLD", 60)
+        test_api.get("/performances/12")
+
+        assert caplog.records == []
+
+    def test_plans_are_captured_for_reads(self, test_api, caplog, monkeypatch):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_EXPLAIN_RATE", 1)
+        monkeypatch.setitem(app.config, "QUERY_COUNT_HEADER", True)
+        res = test_api.get("/performers/summary")
+
+        message = next(record.getMessage() for record in caplog.records
+                       if "EXECUTE performers_summary" in record.getMessage())
+        assert "actual time=" in message
+        assert "Buffers:" in message
+        # Plans are captured on the side and are not counted as the request's work.
+        assert res.headers["X-Query-Count"] == "4"
+
+    def test_writes_are_never_explained(self, test_api, caplog, monkeypatch):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_EXPLAIN_RATE", 1)
+        res = test_api.post("/performances", json={"performer_id": [1], "performance_date": "3000-01-01",
+                                                   "venue_name": "Grand Circus", "review_score": 90})
+
+        writes = [record.getMessage() for record in caplog.records if "INSERT" in record.getMessage()]
+        assert res.json["performance_id"] == 101
+        assert writes and not any("actual time=" in message for message in writes)
+        assert len(test_api.get("/performances").json) == 56
+
+    def test_failed_explain_leaves_the_transaction_usable(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+            plan = explain(test_temp_conn, "SELECT * FROM no_such_table")
+            cur.execute("SELECT 2 AS two;")
+            assert cur.fetchone()["two"] == 2
+        assert plan.startswith("EXPLAIN failed")
+
+
+class TestPerformancesByIds:
+    """Tests for looking up many performances at once with GET /performances?ids=."""
+
+    def test_matches_single_lookups(self, test_api):
+        res = test_api.get("/performances?ids=12,1,25")
+
+        assert res.status_code == 200
+        assert res.json["performances"] == [test_api.get(f"/performances/{performance_id}").json
+                                            for performance_id in (12, 1, 25)]
+        assert res.json["missing_ids"] == []
+
+    def test_missing_ids_are_listed(self, test_api):
+        res = test_api.get("/performances?ids=3,999,4,1000")
+
+        assert [p["performance_id"] for p in res.json["performances"]] == [3, 4]
+        assert res.json["missing_ids"] == [999, 1000]
+
+    def test_repeated_ids_are_returned_once(self, test_api):
+        res = test_api.get("/performances?ids=5,5,5")
+
+        assert len(res.json["performances"]) == 1
+
+    def test_uses_one_query(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "QUERY_COUNT_HEADER", True)
+        test_api.get("/performances?ids=1")
+        res = test_api.get("/performances?ids=" + ",".join(str(i) for i in range(1, 51)))
+
+        # The table versions for the ETag, then the lookup itself.
+        assert res.headers["X-Query-Count"] == "2"
+        assert len(res.json["performances"]) == 40
+
+    @pytest.mark.parametrize("ids", ("", "1,two", "1,,2", "1.5", "99999999999999999999", "1,-99999999999999999999"))
+    def test_malformed_ids_return_400(self, ids, test_api):
+        res = test_api.get(f"/performances?ids={ids}")
+
+        assert res.status_code == 400
+        assert "error" in res.text
+
+    def test_too_many_ids_return_400(self, test_api):
+        res = test_api.get("/performances?ids=" + ",".join(str(i) for i in range(api.MAX_LOOKUP_IDS + 1)))
+
+        assert res.status_code == 400
+
+    @pytest.mark.parametrize("parameter", ("fields=performance_id", "stream=true", "group=performance",
+                                           "venue_id=1", "min_score=50", "from=2024-01-01"))
+    def test_combining_with_list_parameters_returns_400(self, parameter, test_api):
+        res = test_api.get(f"/performances?ids=1,2&{parameter}")
+
+        assert res.status_code == 400
+        assert res.json["message"] == f"The ids query parameter cannot be combined with {parameter.split('=')[0]}."
+
+
+class TestSparseFieldsets:
+    """Tests for choosing the returned fields of the list endpoints with fields=."""
+
+    @pytest.mark.parametrize("route, fields", (
+        ("/performances", ["performance_id", "score"]),
+        ("/performances", ["performance_date", "venue_name"]),
+        ("/performances", ["performer_name"]),
+        ("/performers", ["performer_name"]),
+        ("/performers", ["birth_year", "performer_id"]),
+        ("/performers?sort=specialty", ["performer_name"]),
+        ("/venues", ["venue_name"]),
+        ("/performer_specialty", ["specialty_name", "performer_names"]),
+        ("/performers/summary", ["performer_id", "average_review_score"]),
+    ))
+    def test_rows_are_the_full_rows_projected(self, route, fields, test_api):
+        separator = "&" if "?" in route else "?"
+        full = test_api.get(route).json
+
+        res = test_api.get(f"{route}{separator}fields={','.join(fields)}")
+
+        assert res.status_code == 200
+        assert res.json == [{field: row[field] for field in fields} for row in full]
+
+    def test_fields_keep_the_endpoint_order(self, test_api):
+        res = test_api.get("/performances?fields=score,performance_id")
+
+        assert list(res.json[0]) == ["performance_id", "score"]
+
+    @pytest.mark.parametrize("route", ("/performances", "/venues", "/performer_specialty", "/performers/summary"))
+    @pytest.mark.parametrize("fields", ("performer_dob", "score,", ""))
+    def test_invalid_fields_return_400(self, route, fields, test_api):
+        res = test_api.get(f"{route}?fields={fields}")
+
+        assert res.status_code == 400
+        assert "fields" in res.json["message"]
+
+    def test_unneeded_joins_are_skipped(self, test_api, monkeypatch, caplog):
+        monkeypatch.setitem(app.config, "SLOW_QUERY_THRESHOLD", 0)
+        caplog.set_level("WARNING", logger="database_functions.slow_queries")
+
+        test_api.get("/performances?fields=performance_id,score")
+
+        prepare = next(record.getMessage() for record in caplog.records
+                       if "PREPARE performances_fields" in record.getMessage())
+        assert "JOIN venue" not in prepare
+        assert "JOIN performer " not in prepare
+        assert "performer_stagename" not in prepare
+
+    def test_pagination_with_fields(self, test_api):
+        expected = [row["performer_name"] for row in test_api.get("/performers").json]
+
+        names = []
+        res = test_api.get("/performers?fields=performer_name&limit=4")
+        while True:
+            assert all(list(row) == ["performer_name"] for row in res.json)
+            names += [row["performer_name"] for row in res.json]
+            if "Link" not in res.headers:
+                break
+            res = test_api.get(res.headers["Link"].split(">")[0].lstrip("<"))
+
+        assert names == expected
+
+    def test_streamed_and_database_json_honour_fields(self, test_api, monkeypatch):
+        expected = test_api.get("/performances?fields=venue_name,score").json
+
+        assert test_api.get("/performances?fields=venue_name,score&stream=true").json == expected
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        assert test_api.get("/performances?fields=venue_name,score").json == expected
+
+    @pytest.mark.parametrize("route", ("/venues?fields=venue_name", "/performer_specialty?fields=specialty_id",
+                                       "/performers/summary?fields=performer_stagename,total_performances"))
+    def test_database_json_honours_fields(self, route, test_api, monkeypatch):
+        monkeypatch.setitem(test_api.application.config, "RESPONSE_CACHE_SIZE", 0)
+        expected = test_api.get(route).json
+
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        assert test_api.get(route).json == expected
+
+
+class TestPerformanceFilters:
+    """Tests for filtering GET /performances by date, venue, performer and score."""
+
+    @pytest.fixture
+    def all_performances(self, test_api):
+        return test_api.get("/performances").json
+
+    def test_date_range_is_inclusive(self, test_api, all_performances):
+        res = test_api.get("/performances?from=2023-11-30&to=2024-01-01")
+
+        assert res.status_code == 200
+        assert res.json == [row for row in all_performances
+                            if "2023-11-30" <= row["performance_date"] <= "2024-01-01"]
+        assert res.json
+
+    def test_venue_by_name_and_id(self, test_api, test_temp_conn, all_performances):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT venue_id FROM venue WHERE venue_name = 'Grand Circus'")
+            venue_id = cur.fetchone()["venue_id"]
+
+        by_name = test_api.get("/performances?venue_name=Grand Circus").json
+        by_id = test_api.get(f"/performances?venue_id={venue_id}").json
+
+        assert by_name == by_id == [row for row in all_performances if row["venue_name"] == "Grand Circus"]
+        assert by_name
+
+    def test_unknown_venue_name_matches_nothing(self, test_api):
+        res = test_api.get("/performances?venue_name=Nowhere")
+
+        assert res.status_code == 200
+        assert res.json == []
+
+    def test_performer(self, test_api, test_temp_conn, all_performances):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT performer_stagename FROM performer WHERE performer_id = 3")
+            name = cur.fetchone()["performer_stagename"]
+
+        res = test_api.get("/performances?performer_id=3")
+
+        assert res.json == [row for row in all_performances if row["performer_name"] == name]
+        assert res.json
+
+    def test_score_range_and_fields(self, test_api, all_performances):
+        res = test_api.get("/performances?min_score=80&max_score=90&fields=performance_id,score")
+
+        assert res.json == [{"performance_id": row["performance_id"], "score": row["score"]}
+                            for row in all_performances if 80 <= row["score"] <= 90]
+
+    def test_streamed_and_database_json_honour_filters(self, test_api, monkeypatch):
+        expected = test_api.get("/performances?from=2024-01-01&min_score=50").json
+
+        assert test_api.get("/performances?from=2024-01-01&min_score=50&stream=true").json == expected
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        assert test_api.get("/performances?from=2024-01-01&min_score=50").json == expected
+
+    @pytest.mark.parametrize("query", ("from=2024-13-01", "to=yesterday", "venue_id=x", "performer_id=",
+                                       "min_score=high", "max_score=1.5", "min_score=99999999",
+                                       "max_score=-99999999", "venue_id=99999999999999999999",
+                                       "performer_id=99999999999999999999"))
+    def test_malformed_filters_return_400(self, query, test_api):
+        res = test_api.get(f"/performances?{query}")
+
+        assert res.status_code == 400
+        assert query.split("=")[0] in res.json["message"]
+
+    def test_filters_are_indexed(self, test_temp_conn):
+        with test_temp_conn.cursor() as cur:
+            cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'performance'")
+            definitions = [row["indexdef"] for row in cur.fetchall()]
+
+        for columns in ("(performance_date)", "(venue_id)", "(review_score)"):
+            assert any(definition.endswith(columns) for definition in definitions)
+
+
+class TestCompression:
+    """Tests for Accept-Encoding negotiation and compressed responses."""
+
+    @pytest.mark.parametrize("encoding", sorted(ENCODINGS))
+    def test_body_decompresses_to_the_plain_response(self, encoding, test_api):
+        plain = test_api.get("/performances")
+
+        res = test_api.get("/performances", headers={"Accept-Encoding": encoding})
+
+        assert res.headers["Content-Encoding"] == encoding
+        assert "Accept-Encoding" in res.headers["Vary"]
+        assert int(res.headers["Content-Length"]) < int(plain.headers["Content-Length"])
+        body = gzip.decompress(res.data) if encoding == "gzip" else brotli.decompress(res.data)
+        assert body == plain.data
+
+    @pytest.mark.parametrize("accept_encoding, expected", (
+        ("gzip, deflate, br", "br" if brotli is not None else "gzip"),
+        ("br;q=0, gzip", "gzip"),
+        ("gzip;q=0.5, identity", None),
+        ("deflate", None),
+    ))
+    def test_negotiates_the_client_preference(self, accept_encoding, expected, test_api):
+        res = test_api.get("/performances", headers={"Accept-Encoding": accept_encoding})
+
+        assert res.headers.get("Content-Encoding") == expected
+        assert "Accept-Encoding" in res.headers["Vary"]
+
+    def test_small_responses_are_not_compressed(self, test_api):
+        res = test_api.get("/performances/1", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in res.headers
+        assert "Vary" not in res.headers
+
+    def test_can_be_turned_off(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "COMPRESSION_MIN_SIZE", None)
+
+        res = test_api.get("/performances", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in res.headers
+
+    def test_level_is_configurable(self, test_api, monkeypatch):
+        sizes = []
+        for level in (1, 9):
+            monkeypatch.setitem(app.config, "COMPRESSION_LEVEL", level)
+            sizes.append(len(test_api.get("/performances", headers={"Accept-Encoding": "gzip"}).data))
+
+        assert sizes[1] < sizes[0]
+
+    def test_streamed_responses_are_not_compressed(self, test_api):
+        res = test_api.get("/performances?stream=true", headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in res.headers
+
+    def test_cache_hits_reuse_the_compressed_body(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "COMPRESSION_MIN_SIZE", 0)
+        calls = []
+        monkeypatch.setattr(api, "compress", lambda *args: calls.append(args) or compress(*args))
+
+        miss = test_api.get("/venues", headers={"Accept-Encoding": "gzip"})
+        hit = test_api.get("/venues", headers={"Accept-Encoding": "gzip"})
+        plain = test_api.get("/venues")
+
+        assert [r.headers["X-Cache"] for r in (miss, hit, plain)] == ["MISS", "HIT", "HIT"]
+        assert hit.data == miss.data
+        assert gzip.decompress(hit.data) == plain.data
+        assert len(calls) == 1
+
+    def test_compressed_responses_revalidate(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "COMPRESSION_MIN_SIZE", 0)
+        res = test_api.get("/venues", headers={"Accept-Encoding": "gzip"})
+        assert res.headers["ETag"].startswith('W/"')
+
+        res = test_api.get("/venues", headers={"Accept-Encoding": "gzip", "If-None-Match": res.headers["ETag"]})
+
+        assert res.status_code == 304
+
+    @pytest.mark.parametrize("accept_encoding", ("gzip", "identity"))
+    def test_304_has_the_etag_and_vary_of_the_200(self, accept_encoding, test_api):
+        full = test_api.get("/performances", headers={"Accept-Encoding": accept_encoding})
+
+        res = test_api.get("/performances", headers={"Accept-Encoding": accept_encoding,
+                                                     "If-None-Match": full.headers["ETag"]})
+
+        assert res.status_code == 304
+        assert "Content-Encoding" not in res.headers
+        assert res.headers["ETag"] == full.headers["ETag"]
+        assert res.headers["Vary"] == full.headers["Vary"] == "Accept-Encoding"
+
+
+class TestGroupedPerformances:
+    """Tests for one row per performance with GET /performances?group=performance."""
+
+    def regroup(self, rows):
+        grouped = {}
+        for row in rows:
+            performance = grouped.setdefault(row["performance_id"], {
+                "performance_id": row["performance_id"], "performer_names": [],
+                "performance_date": row["performance_date"], "venue_name": row["venue_name"],
+                "score": row["score"]})
+            performance["performer_names"].append(row["performer_name"])
+        return list(grouped.values())
+
+    def test_matches_regrouped_rows(self, test_api):
+        rows = test_api.get("/performances").json
+
+        res = test_api.get("/performances?group=performance")
+
+        assert res.status_code == 200
+        assert res.json == self.regroup(rows)
+        assert len(res.json) < len(rows)
+
+    def test_filters_and_fields(self, test_api):
+        rows = test_api.get("/performances?from=2023-11-30&min_score=80").json
+
+        res = test_api.get("/performances?group=performance&from=2023-11-30&min_score=80"
+                           "&fields=performance_id,performer_names")
+
+        assert res.json == [{"performance_id": performance["performance_id"],
+                             "performer_names": performance["performer_names"]}
+                            for performance in self.regroup(rows)]
+
+    def test_performer_filter_keeps_whole_performances(self, test_api):
+        res = test_api.get("/performances?group=performance&performer_id=3")
+
+        assert [row["performance_id"] for row in res.json] == [3, 14]
+        assert res.json[1]["performer_names"] == test_api.get("/performances/14").json["performer_names"]
+        assert len(res.json[1]["performer_names"]) == 2
+
+    def test_streamed_and_database_json_modes_match(self, test_api, monkeypatch):
+        expected = test_api.get("/performances?group=performance").json
+
+        assert test_api.get("/performances?group=performance&stream=true").json == expected
+        monkeypatch.setitem(test_api.application.config, "RENDER_JSON_IN_DATABASE", True)
+        assert test_api.get("/performances?group=performance").json == expected
+
+    @pytest.mark.parametrize("query", ("group=performer", "group=", "group=performance&fields=performer_name"))
+    def test_invalid_parameters_return_400(self, query, test_api):
+        res = test_api.get(f"/performances?{query}")
+
+        assert res.status_code == 400
+        assert "error" in res.json
+
+
+class TestReplicaSet:
+    """Tests for spreading reads across replica pools."""
+
+    def pools(self, count):
+        return [MagicMock(name=f"replica{i}") for i in range(count)], MagicMock(name="primary")
+
+    def test_round_robin(self):
+        replicas, primary = self.pools(2)
+        replica_set = ReplicaSet(replicas, primary)
+
+        assert [replica_set.getconn()[0] for _ in range(3)] == [replicas[0], replicas[1], replicas[0]]
+        primary.getconn.assert_not_called()
+
+    def test_unreachable_replica_is_skipped_until_retry(self, monkeypatch):
+        replicas, primary = self.pools(2)
+        replicas[0].getconn.side_effect = OperationalError("connection refused")
+        replica_set = ReplicaSet(replicas, primary, retry_after=30.0)
+
+        assert [replica_set.getconn()[0] for _ in range(3)] == [replicas[1]] * 3
+        assert replicas[0].getconn.call_count == 1
+        assert replica_set.down() == [replicas[0]]
+
+        later = time.monotonic() + 31
+        monkeypatch.setattr(time, "monotonic", lambda: later)
+        replica_set.getconn()
+        replica_set.getconn()
+        assert replicas[0].getconn.call_count == 2
+
+    def test_busy_replica_is_skipped_but_not_marked_down(self):
+        replicas, primary = self.pools(2)
+        replicas[0].getconn.side_effect = PoolError("no connection became free")
+        replica_set = ReplicaSet(replicas, primary)
+
+        assert replica_set.getconn()[0] is replicas[1]
+        assert replica_set.down() == []
+
+    def test_falls_back_to_primary(self):
+        replicas, primary = self.pools(2)
+        for replica in replicas:
+            replica.getconn.side_effect = OperationalError("connection refused")
+
+        pool, conn = ReplicaSet(replicas, primary).getconn()
+
+        assert pool is primary
+        assert conn is primary.getconn.return_value
+
+
+class TestReadReplicaRouting:
+    """Tests for sending reads to replicas and writes to the primary."""
+
+    # The test server again, reached through an address the primary does not use.
+    REPLICA_DSN = "host=127.0.0.1 port=5432"
+
+    @pytest.fixture(autouse=True)
+    def replicas(self, monkeypatch):
+        monkeypatch.setitem(app.config, "DATABASE_REPLICA_DSNS", [self.REPLICA_DSN])
+        monkeypatch.setitem(app.config, "RESPONSE_CACHE_SIZE", 0)
+        api.close_pool()
+        yield
+        api.close_pool()
+
+    def host(self, test_api, method, path, **kwargs):
+        """Sends a request and returns its response and the host its connection went to."""
+        hosts = set()
+        get_db = api.get_db
+
+        def recording_get_db():
+            conn = get_db()
+            hosts.add(conn.info.host)
+            return conn
+
+        with patch.object(api, "get_db", recording_get_db):
+            res = test_api.open(path, method=method, **kwargs)
+        assert len(hosts) == 1
+        return res, hosts.pop()
+
+    def test_reads_go_to_replica_and_writes_to_primary(self, test_api):
+        res, host = self.host(test_api, "GET", "/performances")
+        assert res.status_code == 200
+        assert host == "127.0.0.1"
+
+        data = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 40}
+        res, host = self.host(test_api, "POST", "/performances", json=data)
+        assert res.status_code == 200
+        assert host == "localhost"
+
+    def test_writer_reads_from_primary_for_a_while(self, test_api, monkeypatch):
+        data = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 40}
+        res = test_api.post("/performances", json=data)
+        assert api.READ_YOUR_WRITES_COOKIE in res.headers["Set-Cookie"]
+
+        assert self.host(test_api, "GET", "/performances")[1] == "localhost"
+
+        monkeypatch.setattr(time, "time", lambda: float("inf"))
+        assert self.host(test_api, "GET", "/performances")[1] == "127.0.0.1"
+
+    def test_window_can_be_turned_off(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "READ_YOUR_WRITES_WINDOW", 0)
+        data = {"venue_name": "Grand Circus", "performer_id": [1],
+                "performance_date": "2024-01-01", "review_score": 40}
+
+        res = test_api.post("/performances", json=data)
+
+        assert "Set-Cookie" not in res.headers
+        assert self.host(test_api, "GET", "/performances")[1] == "127.0.0.1"
+
+    def test_busy_replica_fails_over_without_waiting(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "DB_POOL_MAX_SIZE", 1)
+        replica = api.get_replica_set().pools[0]
+        held = replica.getconn()
+        try:
+            started = time.monotonic()
+            res, host = self.host(test_api, "GET", "/performances/1")
+            elapsed = time.monotonic() - started
+        finally:
+            replica.putconn(held)
+
+        assert res.status_code == 200
+        assert host == "localhost"
+        assert elapsed < app.config["DB_POOL_TIMEOUT"] / 10
+        assert api.get_replica_set().down() == []
+
+    def test_unreachable_replica_fails_over_to_primary(self, test_api, monkeypatch):
+        monkeypatch.setitem(app.config, "DATABASE_REPLICA_DSNS", ["host=127.0.0.1 port=1"])
+
+        res, host = self.host(test_api, "GET", "/performances/1")
+
+        assert res.status_code == 200
+        assert host == "localhost"
+        assert len(api.get_replica_set().down()) == 1
+
+
+class TestBenchmarkRegressions:
+    """Tests for how bench_load.py compares a run against its baseline."""
+
+    def result(self, **changes):
+        return {"requests": 200, "errors": 0, "throughput_rps": 100.0, "p50_ms": 10.0, "p95_ms": 20.0,
+                "p99_ms": 30.0, "queries_per_request": 2.0, **changes}
+
+    def compare(self, **changes):
+        baseline = {"routes": {"GET /venues": self.result()}}
+        return find_regressions(baseline, {"routes": {"GET /venues": self.result(**changes)}}, 0.25)
+
+    def test_same_results_pass(self):
+        assert self.compare() == []
+
+    def test_slowdowns_within_the_tolerance_pass(self):
+        assert self.compare(p50_ms=12.5, p95_ms=24.9, p99_ms=300.0) == []
+
+    @pytest.mark.parametrize("key", ("p50_ms", "p95_ms"))
+    def test_slower_latency_is_a_regression(self, key):
+        regressions = self.compare(**{key: 100.0})
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith(f"GET /venues: {key} 100.0")
+
+    def test_more_queries_is_a_regression(self):
+        assert self.compare(queries_per_request=3.0) == [
+            "GET /venues: 3.0 queries per request, was 2.0"]
+
+    def test_more_errors_is_a_regression(self):
+        assert self.compare(errors=1) == ["GET /venues: 1 errors, was 0"]
+
+    def test_route_missing_from_the_baseline_fails(self):
+        current = {"routes": {"GET /venues": self.result(), "GET /new": self.result()}}
+
+        regressions = find_regressions({"routes": {"GET /venues": self.result()}}, current, 0.25)
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith("GET /new: not in the baseline")
+
+    @pytest.mark.parametrize("p, expected", ((50, 50), (95, 95), (99, 99), (100, 100), (0, 1)))
+    def test_percentile_is_nearest_rank(self, p, expected):
+        assert percentile(list(range(1, 101)), p) == expected
+
+    def test_percentile_of_one_value(self):
+        assert percentile([7.0], 99) == 7.0